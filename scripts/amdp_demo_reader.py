@@ -44,7 +44,7 @@ class AMDPDemoReader:
             bag = rosbag.Bag(demo_file)
             for topic, msg, t in bag.read_messages(topics=['/table_sim/task_log']):
                 # Parse messages based on parse modes
-                state = AMDPState(amdp_id=self.amdp_id, state=OOState(state=msg.state))
+                state = AMDPState(amdp_id=self.amdp_id, state=OOState(state=msg.state, lazy=True))
 
                 if prev_state_msg is None:
                     prev_state_msg = copy.deepcopy(msg.state)
@@ -16,9 +16,9 @@ from task_sim import data_utils as DataUtils
 from task_sim.msg import Action, Status
 from task_sim.srv import QueryStatus, SelectAction
 
-from task_sim.oomdp.oo_state import OOState
-from task_sim.str.amdp_state import AMDPState
+from task_sim.str.state_projection_cache import StateProjectionCache
 from task_sim.str.amdp_transitions_learned import AMDPTransitionsLearned
+from task_sim.str.amdp_value_iteration import AMDPValueIteration
 from task_sim.str.amdp_reward import reward, is_terminal
 from task_sim.str.modes import DemonstrationMode
 
@@ -49,6 +49,15 @@ class AMDPNode:
         self.complexity = complexity
         self.env_type = env_type
 
+        # last OOState built from a request, so the next one only recomputes relations of objects that moved
+        self.prev_oo_state = None
+        # OOState and AMDPState projections of recent requests, shared by select_action and query_status
+        self.projection_cache = StateProjectionCache(continuous=self.continuous)
+
+        # greedy policy table, amdp_id -> {state code: (max utility, actions with that utility)}, rebuilt by reinit_U
+        self.policy = {}
+        self.policy_t_ids = set()  # transition functions tracked for updates that invalidate policy entries
+
         a_file_drawer = rospy.get_param('~actions_drawer', rospkg.RosPack().get_path('task_sim') + '/src/task_sim/str/A_drawer.pkl')
         a_file_box = rospy.get_param('~actions_box', rospkg.RosPack().get_path('task_sim') + '/src/task_sim/str/A_box.pkl')
 
@@ -96,17 +105,6 @@ class AMDPNode:
         a.action_type = 11
         self.A[12].append(deepcopy(a))
 
-        if value_tables is None:
-            self.U[0] = pickle.load(file('U0.pkl'))
-            self.U[1] = pickle.load(file('U1.pkl'))
-            self.U[2] = pickle.load(file('U2.pkl'))
-            self.U[4] = pickle.load(file('U4.pkl'))
-            self.U[6] = pickle.load(file('U6.pkl'))
-            self.U[7] = pickle.load(file('U7.pkl'))
-            self.U[8] = pickle.load(file('U8.pkl'))
-            self.U[11] = pickle.load(file('U11.pkl'))
-            self.U[12] = pickle.load(file('U12.pkl'))
-
         if transition_functions is None:
             self.T[0] = AMDPTransitionsLearned(amdp_id=0)
             self.T[2] = AMDPTransitionsLearned(amdp_id=2)
@@ -116,6 +114,19 @@ class AMDPNode:
             self.T[11] = AMDPTransitionsLearned(amdp_id=11)
             self.T[12] = AMDPTransitionsLearned(amdp_id=12)
 
+        if value_tables is None:
+            self.U[0] = pickle.load(file('U0.pkl'))
+            self.U[1] = pickle.load(file('U1.pkl'))
+            self.U[2] = pickle.load(file('U2.pkl'))
+            self.U[6] = pickle.load(file('U6.pkl'))
+            self.U[7] = pickle.load(file('U7.pkl'))
+            self.U[8] = pickle.load(file('U8.pkl'))
+            for amdp_id in (4, 11, 12):
+                value_iterator = AMDPValueIteration(amdp_id, self.T[amdp_id])
+                value_iterator.load_abstract_utilities()
+                self.U[amdp_id] = value_iterator.U
+            self._build_policy()
+
         # demo config, loads modes, policies, and classifiers
         self.demo_mode = demo_mode or DemonstrationMode(
             DemonstrationMode.RANDOM | DemonstrationMode.CLASSIFIER
@@ -161,45 +172,97 @@ class AMDPNode:
             { amdp_id: v.U for (amdp_id, v) in self.U_t.iteritems() }
             if self.U_t is not None else self.U
         )
+        self._build_policy()
+
+    def _utilities(self, amdp_id, s):
+        # one-step lookahead utility of each action of amdp_id from s
+        utilities = {}
+        for a in self.A[amdp_id]:
+            successors = self.T[t_id_map[amdp_id]].transition_function(s, a)
+            u = 0
+            for i in range(len(successors)):
+                p = successors[i][0]
+                s_prime = successors[i][1]
+                if s_prime in self.U[amdp_id]:
+                    u += p*self.U[amdp_id][s_prime]
+                elif is_terminal(s_prime, amdp_id=amdp_id):
+                    u += p*reward(s_prime, amdp_id=amdp_id)
+            utilities[a] = u
+        return utilities
+
+    def _greedy(self, amdp_id, s):
+        # max utility and the actions that reach it, in the order select_action has always considered them
+        utilities = self._utilities(amdp_id, s)
+        max_utility = -999999
+        action_list = []
+        for a in utilities.keys():
+            if utilities[a] > max_utility:
+                max_utility = utilities[a]
+                action_list = [a]
+            elif utilities[a] == max_utility:
+                action_list.append(a)
+        return max_utility, action_list
+
+    def _build_policy(self):
+        """Precompute the greedy actions of every state with a utility, for
+        each amdp with actions. Entries of other states are added as they are
+        queried, and entries of states whose transitions are updated are
+        dropped (see _refresh_policy) until the next rebuild"""
+        self.policy = {}
+        self.policy_t_ids = set()
+        for amdp_id, U in self.U.iteritems():
+            if amdp_id not in self.A:
+                continue
+            self._track_policy_transitions(t_id_map[amdp_id])
+            self.policy[amdp_id] = dict((s.code, self._greedy(amdp_id, s)) for s in U.keys())
+
+    def _track_policy_transitions(self, t_id):
+        if t_id not in self.policy_t_ids:
+            self.T[t_id].track_updates(self)
+            self.policy_t_ids.add(t_id)
+
+    def _refresh_policy(self):
+        # drop the entries of states whose transitions were learned since they were computed
+        for t_id in self.policy_t_ids:
+            codes = [s.code for s in self.T[t_id].pop_updated_states(self)]
+            if len(codes) == 0:
+                continue
+            for amdp_id, policy in self.policy.iteritems():
+                if t_id_map[amdp_id] == t_id:
+                    for code in codes:
+                        policy.pop(code, None)
+
+    def _greedy_actions(self, amdp_id, s):
+        """Returns the max one-step lookahead utility from s and the list of
+        actions with that utility, from the policy table. The actions belong
+        to self.A and must be copied before they are modified"""
+        if amdp_id not in self.policy:
+            self._track_policy_transitions(t_id_map[amdp_id])
+            self.policy[amdp_id] = {}
+        policy = self.policy[amdp_id]
+        greedy = policy.get(s.code)
+        if greedy is None:
+            greedy = self._greedy(amdp_id, s)
+            policy[s.code] = greedy
+        return greedy
 
     def select_action(self, req, debug=1):
         action = Action()
 
         action_list = []
 
-        oo_state = OOState(state=req.state, continuous=self.continuous)
+        projections = self.projection_cache.get(req.state, prev=self.prev_oo_state)
+        self.prev_oo_state = projections.oo_state
+
+        self._refresh_policy()
 
         if self.complexity > 0:
             # TODO: this is commented out for drawer-only testing!
             # start at the top level
-            s = AMDPState(amdp_id=12, state=oo_state)
-            utilities = {}
-            for a in self.A[12]:
-                successors = self.T[t_id_map[12]].transition_function(s, a)
-                u = 0
-                for i in range(len(successors)):
-                    p = successors[i][0]
-                    s_prime = successors[i][1]
-                    if s_prime in self.U[12]:
-                        u += p*self.U[12][s_prime]
-                    elif is_terminal(s_prime, amdp_id=12):
-                        u += p*reward(s_prime, amdp_id=12)
-                utilities[a] = u
-
-            # print '\n---'
-            # for key in utilities:
-            #     print str(key)
-            #     print 'utility: ' + str(utilities[key])
+            s = projections.amdp_state(12)
 
             # pick top action deterministically
-            max_utility = -999999
-            for a in utilities.keys():
-                if utilities[a] > max_utility:
-                    max_utility = utilities[a]
-                    action_list = []
-                    action_list.append(deepcopy(a))
-                elif utilities[a] == max_utility:
-                    action_list.append(deepcopy(a))
+            max_utility, action_list = self._greedy_actions(12, s)
 
             # select action
             # i = randint(0, len(action_list) - 1)
@@ -210,7 +273,7 @@ class AMDPNode:
             if debug > 0:
                 print 'Top level action selection: ' + str(id)
 
-            s = AMDPState(amdp_id=id, state=oo_state)
+            s = projections.amdp_state(id)
             # s = AMDPState(amdp_id=4, state=oo_state)  # TODO: temporary, for drawer-only testing
 
         else:
@@ -219,7 +282,7 @@ class AMDPNode:
             else:
                 id = 11
 
-            s = AMDPState(amdp_id=id, state=oo_state, ground_items=['apple', 'apple', 'apple', 'apple'])
+            s = projections.amdp_state(id, ground_items=['apple', 'apple', 'apple', 'apple'])
 
         # TODO: debugging state
         print '\n\n-------------------------------------------------------------'
@@ -227,33 +290,8 @@ class AMDPNode:
         print str(s)
         print '-------------------------------------------------------------\n\n'
 
-        utilities = {}
-        for a in self.A[id]:
-            successors = self.T[t_id_map[id]].transition_function(s, a)
-            u = 0
-            for i in range(len(successors)):
-                p = successors[i][0]
-                s_prime = successors[i][1]
-                if s_prime in self.U[id]:
-                    u += p*self.U[id][s_prime]
-                elif is_terminal(s_prime, amdp_id=id):
-                    u += p*reward(s_prime, amdp_id=id)
-            utilities[a] = u
-
-        # print '\n---'
-        # for key in utilities:
-        #     print str(key)
-        #     print 'utility: ' + str(utilities[key])
-
         # pick top action deterministically
-        max_utility = -999999
-        for a in utilities.keys():
-            if utilities[a] > max_utility:
-                max_utility = utilities[a]
-                action_list = []
-                action_list.append(deepcopy(a))
-            elif utilities[a] == max_utility:
-                action_list.append(deepcopy(a))
+        max_utility, action_list = self._greedy_actions(id, s)
 
         # select action
         # i = randint(0, len(action_list) - 1)
@@ -272,7 +310,7 @@ class AMDPNode:
 
         # solve lower level mdp for executable action
         action_list = []
-        s = AMDPState(amdp_id=id, state=oo_state, ground_items=[obj])
+        s = projections.amdp_state(id, ground_items=[obj])
 
         # TODO: debugging state
         print '\n\n-------------------------------------------------------------'
@@ -373,46 +411,20 @@ class AMDPNode:
                         action.object = obj
 
         else:
-            utilities = {}
-            for a in self.A[id]:
-                successors = self.T[t_id_map[id]].transition_function(s, a)
-                u = 0
-                for i in range(len(successors)):
-                    p = successors[i][0]
-                    s_prime = successors[i][1]
-                    if s_prime in self.U[id]:
-                        u += p*self.U[id][s_prime]
-                    elif is_terminal(s_prime, amdp_id=id):
-                        u += p*reward(s_prime, amdp_id=id)
-                utilities[a] = u
-
-            # print '\n---'
-            # for key in utilities:
-            #     print str(key)
-            #     print 'utility: ' + str(utilities[key])
-
             # pick top action deterministically
-            max_utility = -999999
-            for a in utilities.keys():
-                if utilities[a] > max_utility:
-                    max_utility = utilities[a]
-                    action_list = []
-                    action = deepcopy(a)
-                    if action.object == 'apple':
-                        if obj not in items:
-                            action.object = items[randint(0, len(items) - 1)]
-                        else:
-                            action.object = obj
-                    action_list.append(deepcopy(action))
-                elif utilities[a] == max_utility:
-                    action = deepcopy(a)
-                    if action.object == 'apple':
-                        if obj not in items:
-                            action.object = items[randint(0, len(items) - 1)]
-                        else:
-                            action.object = obj
-                    action_list.append(deepcopy(action))
-                if debug > 1:
+            max_utility, greedy_actions = self._greedy_actions(id, s)
+            action_list = []
+            for a in greedy_actions:
+                action = deepcopy(a)
+                if action.object == 'apple':
+                    if obj not in items:
+                        action.object = items[randint(0, len(items) - 1)]
+                    else:
+                        action.object = obj
+                action_list.append(action)
+            if debug > 1:
+                utilities = self._utilities(id, s)
+                for a in utilities.keys():
                     print 'Action: ', a.action_type, ':', a.object, ', Utility: ', utilities[a]
 
             if max_utility != 0 and max_utility > 0:  # there is a successor state is in the utility table
@@ -632,9 +644,10 @@ class AMDPNode:
         if req.state.lid_position.x != req.state.box_position.x or req.state.lid_position.y != req.state.box_position.y:
             completed = False
 
-        oo_state = OOState(state=req.state, continuous=self.continuous)
+        projections = self.projection_cache.get(req.state, prev=self.prev_oo_state)
+        self.prev_oo_state = projections.oo_state
         amdp_id = 12
-        s = AMDPState(amdp_id=amdp_id, state=oo_state)
+        s = projections.amdp_state(amdp_id)
         if is_terminal(s, amdp_id=amdp_id):
             status.status_code = Status.COMPLETED
 
@@ -4,9 +4,7 @@
 from __future__ import print_function, division
 
 # System imports
-import os
 import sys
-import pickle
 import datetime
 import threading
 import multiprocessing
@@ -14,7 +12,6 @@ import numpy as np
 
 # ROS Imports
 import rospy
-import rospkg
 from std_srvs.srv import Empty
 
 # task_sim imports
@@ -36,8 +33,6 @@ class AMDPQLearner(object):
     transition functions and values"""
 
     def __init__(self):
-        root_path = rospkg.RosPack().get_path('task_sim')
-
         # TODO: come up with something more permanent
         self.report = []
 
@@ -90,11 +85,7 @@ class AMDPQLearner(object):
             # # Initialize the value functions (for higher level amdps)
             if amdp_id in (4,11,12,): # Pre-calculated high-level value functions
                 self.Us[amdp_id] = AMDPValueIteration(amdp_id, self.Ts[amdp_id])
-                with open(
-                    os.path.join(root_path, 'src/task_sim/str/U{}.pkl'.format(amdp_id)),
-                    'rb'
-                ) as fd:
-                    self.Us[amdp_id].U = pickle.load(fd)
+                self.Us[amdp_id].load_abstract_utilities()
 
         # Instantiate interfaces to the environments. Q-learning takes 7 environments
         self.simulators = {} # Format: (amdp_id, simulator_name). None -> full task
@@ -69,11 +69,14 @@ class AMDPTester(object):
             #         'rb'
             #     ) as fd:
             #         self.Us[amdp_id].U = pickle.load(fd)
-            with open(
-                os.path.join(root_path, 'src/task_sim/str/U{}.pkl'.format(amdp_id)),
-                'rb'
-            ) as fd:
-                self.Us[amdp_id].U = pickle.load(fd)
+            if amdp_id in (4,11,12,):
+                self.Us[amdp_id].load_abstract_utilities()
+            else:
+                with open(
+                    os.path.join(root_path, 'src/task_sim/str/U{}.pkl'.format(amdp_id)),
+                    'rb'
+                ) as fd:
+                    self.Us[amdp_id].U = pickle.load(fd)
 
         # Instantiate the AMDP Node
         self.amdp_node = AMDPNode('amdp', self.Ts, self.Us, self.demo_mode, continuous=True)
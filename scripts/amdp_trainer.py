@@ -4,9 +4,8 @@
 from __future__ import print_function, division
 
 # System imports
-import os
 import sys
-import pickle
+import random
 import datetime
 import threading
 import multiprocessing
@@ -14,20 +13,68 @@ import numpy as np
 
 # ROS Imports
 import rospy
-import rospkg
 from std_srvs.srv import Empty
 
 # task_sim imports
 from task_sim.msg import Action, State, Status
-from task_sim.srv import Execute, QueryState, QueryStatus, SelectAction
+from task_sim.srv import Execute, QueryState, QueryStatus, QueryStatusRequest, SelectAction, SelectActionRequest
 from task_sim.str.modes import DemonstrationMode
 from task_sim.str.amdp_value_iteration import AMDPValueIteration
-from task_sim.str.amdp_transitions_learned import AMDPTransitionsLearned
+from task_sim.str.amdp_transitions_learned import AMDPTransitionsLearned, TransitionCounts
+from task_sim.vector_table_sim import VectorTableSim
 from learn_transition_function import LearnTransitionFunction
 from amdp_node import AMDPNode
 
 # Helper functions and classes
 
+def _run_learner_worker(conn, learner, random_seed):
+    """Run the epochs of one transition learner in a worker process until told
+    to close. The learner records its transitions in its own TransitionCounts,
+    and the counts of each epoch are sent back to be merged into the master
+    transition function
+
+    Keyword arguments:
+    conn -- worker end of the pipe to the trainer
+    learner -- LearnTransitionFunction, copied into this process
+    random_seed -- seed for the learner's exploration, so that the workers
+        don't share one random stream
+    """
+    random.seed(random_seed)
+    counts = TransitionCounts()
+    learner.transition_function = counts
+    while True:
+        command, data = conn.recv()
+        if command != 'epoch':
+            break
+        epoch, exploit_epsilon = data
+        learner.exploit_epsilon = exploit_epsilon
+        while learner.epoch == epoch:
+            learner.run()
+        conn.send((
+            counts.pop_counts(),
+            learner.epoch, learner.successes, learner.action_executions
+        ))
+    conn.close()
+
+def _run_evaluator(conn, trainer, eval_seeds, random_seed):
+    """Evaluate a shard of seeds in a forked process, on the trainer's
+    snapshot of the value and transition functions taken at the fork. Sends
+    back the successes, in seed order, and the action counters of the shard
+
+    Keyword arguments:
+    conn -- evaluator end of the pipe to the trainer
+    trainer -- AMDPTrainer, copied into this process
+    eval_seeds -- seeds of this evaluator's shard
+    random_seed -- seed for the action selection of this evaluator, so that
+        the shards don't share one random stream
+    """
+    random.seed(random_seed)
+    trainer.total_actions = 0
+    trainer.actions_from_learned_policy = 0
+    successes = trainer.evaluate_batch(eval_seeds, processes=0)
+    conn.send((successes, trainer.total_actions, trainer.actions_from_learned_policy,))
+    conn.close()
+
 # Trainer node
 
 class AMDPTrainer(object):
@@ -35,8 +82,6 @@ class AMDPTrainer(object):
     transition functions and values"""
 
     def __init__(self):
-        root_path = rospkg.RosPack().get_path('task_sim')
-
         # TODO: come up with something more permanent
         self.report = []
 
@@ -62,6 +107,24 @@ class AMDPTrainer(object):
 
         self.exploit_policy = rospy.get_param('~exploit_policy', False)
 
+        # Solve the learned AMDPs with sparse matrix backups instead of per-state transition lookups
+        self.compiled_solver = rospy.get_param('~compiled_solver', True)
+
+        # Re-solve the learned AMDPs only around the transitions updated since the last solve; when set, this
+        # takes precedence over compiled_solver
+        self.incremental_solver = rospy.get_param('~incremental_solver', False)
+
+        # Run evaluation episodes on in-process simulators stepped together instead of the eval simulator node
+        self.vector_eval = rospy.get_param('~vector_eval', True)
+        self.eval_processes = rospy.get_param('~eval_processes', 0)  # 0 steps the simulators in this process
+        # Number of processes to shard evaluation seeds across, each selecting actions on its own copy of the policy;
+        # only used with vector_eval, since the eval simulator node runs one episode at a time
+        self.evaluator_processes = rospy.get_param('~evaluator_processes', 0)
+
+        # Run each transition learner in its own process instead of a thread, merging its counts after every epoch
+        self.learner_processes = rospy.get_param('~learner_processes', False)
+        self.learner_workers = {}
+
         # Create the different amdp_ids
         self.amdp_ids = (0,1,2,6,7,8,4,11,12,) # definition in amdp_node.py
 
@@ -82,24 +145,28 @@ class AMDPTrainer(object):
             self.best_test_performance = -1
             self.suffix = '_best_' + str(datetime.datetime.now())[:-7].replace(' ', '_').replace(':', '-')
 
+        # Keep transition counts in memory and checkpoint them to HDF5 in bulk
+        transition_write_behind = rospy.get_param('~transition_write_behind', True)
+        transition_flush_interval = rospy.get_param('~transition_flush_interval', 10000)
+
         # Instantiate the transition functions and the utility functions
         self.Ts = {}
         self.Us = {}
         for amdp_id in self.amdp_ids:
             if amdp_id not in (1,7,): # Don't repeat transition functions
                 transition_filename = None if amdp_id in (4,11,12,) else "T{}.hdf5".format(amdp_id)
-                self.Ts[amdp_id] = AMDPTransitionsLearned(amdp_id, transition_filename)
+                self.Ts[amdp_id] = AMDPTransitionsLearned(
+                    amdp_id, transition_filename,
+                    write_behind=transition_write_behind,
+                    flush_interval=transition_flush_interval
+                )
             else:
                 self.Ts[amdp_id] = self.Ts[amdp_id-1]
 
             # Initialize the value functions
             self.Us[amdp_id] = AMDPValueIteration(amdp_id, self.Ts[amdp_id])
             if amdp_id in (4,11,12,): # Pre-calculated high-level value functions
-                with open(
-                    os.path.join(root_path, 'src/task_sim/str/U{}.pkl'.format(amdp_id)),
-                    'rb'
-                ) as fd:
-                    self.Us[amdp_id].U = pickle.load(fd)
+                self.Us[amdp_id].load_abstract_utilities()
 
         # Instantiate interfaces to the environments. Always have 5 environments
         self.simulators = {} # Format: (amdp_id, simulator_name). None -> full task
@@ -123,6 +190,10 @@ class AMDPTrainer(object):
 
         self.max_episode_length = rospy.get_param('~max_episode_length', 100)
 
+        # Evaluation counters
+        self.actions_from_learned_policy = 0
+        self.total_actions = 0
+
         # Instantiate the transition function learners
         self.transition_learners = {}
         self.demo_configs = {}
@@ -158,11 +229,63 @@ class AMDPTrainer(object):
     def _run_transition_learner(self, learner, epoch):
         while learner.epoch == epoch:
             learner.run()
+        self._decay_exploit_epsilon(learner)
+
+    def _decay_exploit_epsilon(self, learner):
         if self.exploit_policy:
             learner.exploit_epsilon *= 0.999
             if learner.exploit_epsilon < 0.05:
                 learner.exploit_epsilon = 0.05
 
+    def _start_learner_workers(self):
+        """Fork a worker process for each transition learner"""
+        for key, transition_learner in self.transition_learners.iteritems():
+            parent_conn, child_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(
+                target=_run_learner_worker,
+                args=(child_conn, transition_learner, random.randint(0, sys.maxint),)
+            )
+            worker.daemon = True
+            worker.start()
+            child_conn.close()
+            self.learner_workers[key] = (parent_conn, worker,)
+
+    def _stop_learner_workers(self):
+        for key, (conn, worker) in self.learner_workers.iteritems():
+            conn.send(('close', None,))
+            conn.close()
+            worker.join()
+        self.learner_workers = {}
+
+    def _run_learner_workers(self, epoch):
+        """Run an epoch of every transition learner in its worker process, then
+        merge the transition counts of the epoch into the master Ts and update
+        the trainer's copy of each learner's counters"""
+        for key, (conn, worker) in self.learner_workers.iteritems():
+            conn.send(('epoch', (epoch, self.transition_learners[key].exploit_epsilon,),))
+
+        for key, (conn, worker) in self.learner_workers.iteritems():
+            try:
+                counts, learner_epoch, successes, action_executions = conn.recv()
+            except EOFError:
+                worker.join(1)
+                raise RuntimeError(
+                    "Transition learner worker for {} exited (exit code {})".format(key, worker.exitcode)
+                )
+            transition_learner = self.transition_learners[key]
+            self.Ts[key[1]].merge_counts(counts)
+            transition_learner.epoch = learner_epoch
+            transition_learner.successes = successes
+            transition_learner.action_executions = action_executions
+            self._decay_exploit_epsilon(transition_learner)
+
+    def _solve(self, value_iterator):
+        value_iterator.init_updated_utilities()
+        if self.incremental_solver:
+            value_iterator.solve_incremental()
+        else:
+            value_iterator.solve(compiled=self.compiled_solver)
+
     def train(self, epochs=2502, test_every=10, save_every=100):
         """Trains the transition function, the value function, etc.
         TODO: Maybe some of the options here should be part of the experiment
@@ -182,21 +305,20 @@ class AMDPTrainer(object):
             print("Evaluating for", eval_trials, "trials over all training environments...")
             success_rate_demo = 0.0
             success_rate_train = 0.0
-            for env in self.task_envs:
-                eval_seed = env[0]
-                for i in range(eval_trials):
-                    if self.evaluate(eval_seed):
-                        if eval_seed < 10:
-                            success_rate_demo += 1
-                        else:
-                            success_rate_train += 1
-                        amdp_node_successes += 1
-                    amdp_node_executions += 1
+            eval_seeds = [env[0] for env in self.task_envs for i in range(eval_trials)]
+            for eval_seed, success in zip(eval_seeds, self._evaluate_seeds(eval_seeds)):
+                if success:
+                    if eval_seed < 10:
+                        success_rate_demo += 1
+                    else:
+                        success_rate_train += 1
+                    amdp_node_successes += 1
+                amdp_node_executions += 1
 
             print("Evaluating over all", len(self.test_envs), "heldout test environments...")
             success_rate_test = 0.0
-            for test_seed in self.test_envs:
-                if self.evaluate(test_seed):
+            for success in self._evaluate_seeds(self.test_envs):
+                if success:
                     success_rate_test += 1
 
             print("**********************************************************************************")
@@ -221,6 +343,9 @@ class AMDPTrainer(object):
 
             return
 
+        if self.learner_processes:
+            self._start_learner_workers()
+
         while epoch < epochs:
             current_seed = self.task_envs[(epoch%num_envs)][0]
 
@@ -231,6 +356,8 @@ class AMDPTrainer(object):
                 rospy.set_param(simulator_api['seed_param_name'], current_seed)
                 simulator_api['reset_sim']()
 
+                if self.learner_processes:
+                    continue
                 worker = threading.Thread(
                     target=self._run_transition_learner,
                     args=(transition_learner, epoch,)
@@ -238,8 +365,12 @@ class AMDPTrainer(object):
                 learn_workers.append((key, transition_learner, worker,))
                 worker.start()
 
+            if self.learner_processes:
+                self._run_learner_workers(epoch)
             for key, transition_learner, worker in learn_workers:
                 worker.join()
+
+            for key, transition_learner in self.transition_learners.iteritems():
                 print(
                     "Trained:", key,
                     "Epoch:", transition_learner.epoch,
@@ -254,8 +385,7 @@ class AMDPTrainer(object):
                         continue
 
                     print("Solving:", amdp_id)
-                    value_iterator.init_updated_utilities()
-                    value_iterator.solve()
+                    self._solve(value_iterator)
 
                 self.amdp_node.reinit_U()
                 for id, amdp_training_node in self.amdp_training_nodes.iteritems():
@@ -273,8 +403,7 @@ class AMDPTrainer(object):
                             continue
 
                         print("Solving:", amdp_id)
-                        value_iterator.init_updated_utilities()
-                        value_iterator.solve()
+                        self._solve(value_iterator)
 
                     self.amdp_node.reinit_U()
 
@@ -284,24 +413,23 @@ class AMDPTrainer(object):
                 success_rate_train = 0.0
                 self.actions_from_learned_policy = 0
                 self.total_actions = 0
-                for env in self.task_envs:
-                    eval_seed = env[0]
-                    for i in range(eval_trials):
-                        if self.evaluate(eval_seed):
-                            if eval_seed < 10:
-                                success_rate_demo += 1
-                            else:
-                                success_rate_train += 1
-                            amdp_node_successes += 1
-                        amdp_node_executions += 1
+                eval_seeds = [env[0] for env in self.task_envs for i in range(eval_trials)]
+                for eval_seed, success in zip(eval_seeds, self._evaluate_seeds(eval_seeds)):
+                    if success:
+                        if eval_seed < 10:
+                            success_rate_demo += 1
+                        else:
+                            success_rate_train += 1
+                        amdp_node_successes += 1
+                    amdp_node_executions += 1
                 rate_action_from_utility = float(self.actions_from_learned_policy)/self.total_actions
                 self.actions_from_learned_policy = 0
                 self.total_actions = 0
 
                 print("Evaluating over all", len(self.test_envs), "heldout test environments...")
                 success_rate_test = 0.0
-                for test_seed in self.test_envs:
-                    if self.evaluate(test_seed):
+                for success in self._evaluate_seeds(self.test_envs):
+                    if success:
                         success_rate_test += 1
                 rate_action_from_utility_test = float(self.actions_from_learned_policy)/self.total_actions
 
@@ -346,11 +474,109 @@ class AMDPTrainer(object):
 
             # If it is time to save
             if epoch % save_every == 0 and epoch > 0:
-                # TODO: Need to save the transition functions and the value tables
-                pass
+                # TODO: Need to save the value tables
+                for amdp_id in self.amdp_ids:
+                    if amdp_id not in (1,7,4,11,12):  # Don't repeat transition functions, don't save non-learned
+                        self.Ts[amdp_id].save()
 
             epoch += 1
 
+        if self.learner_processes:
+            self._stop_learner_workers()
+
+    def _evaluate_seeds(self, eval_seeds):
+        if self.vector_eval:
+            if self.evaluator_processes > 0:
+                return self.evaluate_parallel(eval_seeds)
+            return self.evaluate_batch(eval_seeds)
+        return [self.evaluate(eval_seed) for eval_seed in eval_seeds]
+
+    def _eval_status(self, state):
+        return self.amdp_node.query_status(QueryStatusRequest(state=state)).status_code
+
+    def evaluate_parallel(self, eval_seeds):
+        """Shard the seeds across forked evaluator processes, each running
+        evaluate_batch on its own simulators and its own copy of the current
+        value and transition functions. Returns the list of successes, in seed
+        order, and adds the action counters of every shard to the trainer's"""
+        processes = min(self.evaluator_processes, len(eval_seeds))
+        evaluators = []
+        start = 0
+        for i in range(processes):
+            # contiguous shards, so results concatenate back into seed order
+            shard = len(eval_seeds)//processes + (1 if i < len(eval_seeds) % processes else 0)
+            parent_conn, child_conn = multiprocessing.Pipe()
+            evaluator = multiprocessing.Process(
+                target=_run_evaluator,
+                args=(child_conn, self, eval_seeds[start:start + shard], random.randint(0, sys.maxint),)
+            )
+            evaluator.daemon = True
+            evaluator.start()
+            child_conn.close()
+            evaluators.append((parent_conn, evaluator,))
+            start += shard
+
+        successes = []
+        for conn, evaluator in evaluators:
+            shard_successes, total_actions, actions_from_learned_policy = conn.recv()
+            conn.close()
+            evaluator.join()
+            successes.extend(shard_successes)
+            self.total_actions += total_actions
+            self.actions_from_learned_policy += actions_from_learned_policy
+        return successes
+
+    def evaluate_batch(self, eval_seeds, processes=None):
+        """Run one evaluation episode per seed on a VectorTableSim, stepping
+        all unfinished episodes together. Returns the list of successes, in
+        seed order, with the same episode semantics as evaluate()
+
+        Keyword arguments:
+        processes -- worker processes for the simulators, None for ~eval_processes
+        """
+        if processes is None:
+            processes = self.eval_processes
+        eval_name = self.simulators[None]
+        sims = VectorTableSim(
+            len(eval_seeds), processes=processes, status_function=self._eval_status,
+            complexity=rospy.get_param(eval_name+'/complexity', 1),
+            env_type=rospy.get_param(eval_name+'/env_type', 0),
+            history_buffer=rospy.get_param(eval_name+'/history_buffer', 10)
+        )
+        states = sims.reset_all(list(eval_seeds))
+        statuses = [Status.IN_PROGRESS] * len(eval_seeds)
+        num_steps = 0
+
+        while Status.IN_PROGRESS in statuses:
+            if num_steps > self.max_episode_length:
+                statuses = [
+                    Status.TIMEOUT if status == Status.IN_PROGRESS else status
+                    for status in statuses
+                ]
+                break
+
+            actions = [None] * len(eval_seeds)
+            for i, status in enumerate(statuses):
+                if status != Status.IN_PROGRESS:
+                    continue
+                actions[i], action_source = self.amdp_node.select_action(
+                    SelectActionRequest(state=states[i], prev_action=Action())
+                )
+
+                self.total_actions += 1
+                if action_source == 1:
+                    self.actions_from_learned_policy += 1
+
+            states, step_statuses = sims.step_batch(actions)
+            for i, status in enumerate(step_statuses):
+                if status is not None:
+                    statuses[i] = status
+
+            num_steps += 1
+
+        sims.close()
+        return [status == Status.COMPLETED for status in statuses]
+
     def evaluate(self, eval_seed):
         simulator_api = self.simulator_api[self.simulators[None]]
         rospy.set_param(simulator_api['seed_param_name'], eval_seed)
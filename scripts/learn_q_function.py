@@ -131,6 +131,7 @@ class LearnQFunction:
 
         self.n = 0  # number of executions
         self.prev_state = None
+        self.prev_oo_state = None
         self.timeout = 0
         self.max_episode_length = max_episode_length
 
@@ -141,7 +142,8 @@ class LearnQFunction:
 
     def run(self):
         state_msg = self.query_state().state
-        s = AMDPState(amdp_id=self.amdp_id, state=OOState(state=state_msg))
+        self.prev_oo_state = OOState(state=state_msg, prev=self.prev_oo_state, lazy=True)
+        s = AMDPState(amdp_id=self.amdp_id, state=self.prev_oo_state)
 
         self.timeout += 1
 
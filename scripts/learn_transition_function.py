@@ -131,6 +131,7 @@ class LearnTransitionFunction:
 
         self.n = 0  # number of executions
         self.prev_state = None
+        self.prev_oo_state = None
         self.timeout = 0
         self.max_episode_length = max_episode_length
 
@@ -146,7 +147,9 @@ class LearnTransitionFunction:
 
     def run(self):
         state_msg = self.query_state().state
-        s = AMDPState(amdp_id=self.amdp_id, state=OOState(state=state_msg))
+        oo_state = OOState(state=state_msg, prev=self.prev_oo_state, lazy=True)
+        self.prev_oo_state = oo_state
+        s = AMDPState(amdp_id=self.amdp_id, state=oo_state)
 
         self.timeout += 1
 
@@ -314,7 +317,8 @@ class LearnTransitionFunction:
                         a = self.A[randint(0, len(self.A) - 1)]
 
         self.execute_action(action_to_sim(deepcopy(a), state_msg))
-        s_prime = AMDPState(amdp_id=self.amdp_id, state=OOState(state=self.query_state().state))
+        self.prev_oo_state = OOState(state=self.query_state().state, prev=oo_state, lazy=True)
+        s_prime = AMDPState(amdp_id=self.amdp_id, state=self.prev_oo_state)
         self.action_executions += 1
 
         self.transition_function.update_transition(s, a, s_prime)
@@ -14,7 +14,9 @@ from task_sim.srv import QueryStatus, SelectAction
 
 from task_sim.oomdp.oo_state import OOState
 from task_sim.str.relation_state import RelationState
+from task_sim.str.relation_transition_table import RelationTransitionTable
 from task_sim.str.relation_transitions import transition_function
+from task_sim.str.relation_value_iteration import load_utilities
 from task_sim.str.relation_reward import reward, is_terminal
 
 class RelationMDPNode:
@@ -22,10 +24,19 @@ class RelationMDPNode:
     def __init__(self):
         u_file = rospy.get_param('~utilities', 'U_iter_13.pkl')
         a_file = rospy.get_param('~actions', 'A.pkl')
+        t_file = rospy.get_param('~transitions', '')
 
-        self.U = pickle.load(file(u_file))
+        if u_file.endswith('.npz'):
+            self.U = load_utilities(u_file)
+        else:
+            self.U = pickle.load(file(u_file))
         self.A = pickle.load(file(a_file))
 
+        # precomputed transitions (see RelationTransitionTable), falling back to the model for states not in the table
+        self.transition_function = transition_function
+        if t_file != '':
+            self.transition_function = RelationTransitionTable(t_file).transition_function
+
         self.intervention_requested = False
         self.handle_intervention_action = False
 
@@ -38,13 +49,13 @@ class RelationMDPNode:
 
         action_list = []
 
-        oo_state = OOState(state=req.state)
+        oo_state = OOState(state=req.state, lazy=True)
         s = RelationState(state=oo_state)
         print str(s.relations)
 
         utilities = {}
         for a in self.A:
-            successors = transition_function(s, a)
+            successors = self.transition_function(s, a)
             u = 0
             for i in range(len(successors)):
                 p = successors[i][0]
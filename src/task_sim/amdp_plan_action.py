@@ -65,9 +65,9 @@ class AMDPPlanAction:
             self.action_object = ''
 
         # compute amdp state representation
-        s0_prime = AMDPState(amdp_id=self.amdp_id, state=OOState(state=s0))
+        s0_prime = AMDPState(amdp_id=self.amdp_id, state=OOState(state=s0, lazy=True))
         if s1 is not None:
-            s1_prime = AMDPState(amdp_id=self.amdp_id, state=OOState(state=s1))
+            s1_prime = AMDPState(amdp_id=self.amdp_id, state=OOState(state=s1, lazy=True))
 
         # ********************************  Preconditions  ********************************
         self.preconditions = self.state_to_preconditions(s0_prime)
@@ -103,7 +103,7 @@ class AMDPPlanAction:
         return preconditions
 
     def check_preconditions(self, state, ground_items=None):
-        s = AMDPState(amdp_id=self.amdp_id, state=OOState(state=state), ground_items=ground_items)
+        s = AMDPState(amdp_id=self.amdp_id, state=OOState(state=state, lazy=True), ground_items=ground_items)
         ps = self.state_to_preconditions(s)
         for key, value in self.preconditions.iteritems():
             if not (key in ps and ps[key] == value):
@@ -111,7 +111,7 @@ class AMDPPlanAction:
         return True
 
     def check_effects(self, state, ground_items=None):
-        s = AMDPState(amdp_id=self.amdp_id, state=OOState(state=state), ground_items=ground_items)
+        s = AMDPState(amdp_id=self.amdp_id, state=OOState(state=state, lazy=True), ground_items=ground_items)
         ps = self.state_to_preconditions(s)
         for key, value in self.effects.iteritems():
             if not (key in ps and ps[key] == value):
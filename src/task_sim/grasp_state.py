@@ -8,14 +8,19 @@ from geometry_msgs.msg import Point
 
 class GraspState():
 
-    def __init__(self, neighbors = 0, position = Point(0, 0, 0)):
+    def __init__(self, neighbors = 0, position = Point(0, 0, 0), rand = random):
         self.neighbors = None
         self.position = None
-        self.updateGraspRate(neighbors, position)
+        self.updateGraspRate(neighbors, position, rand)
 
-    def updateGraspRate(self, neighbors, position):
+    def updateGraspRate(self, neighbors, position, rand = random):
+        """Resample graspability when the neighbor count or position changes
+
+        Keyword arguments:
+        rand -- function returning a uniform sample in [0, 1), e.g. the simulator's own random stream
+        """
         if neighbors == self.neighbors and position == self.position:
             return
-        self.graspable = random() < pow(2, -.25*neighbors)
+        self.graspable = rand() < pow(2, -.25*neighbors)
         self.neighbors = neighbors
         self.position = position
\ No newline at end of file
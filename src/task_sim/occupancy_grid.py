@@ -0,0 +1,206 @@
+"""Spatial index over the integer cells of the table simulator.
+
+Objects and containers are indexed by the (x, y, z) cells they occupy, and are re-indexed by the simulator whenever it
+moves them. The box, lid and drawer are kept as sets of occupied cells, rebuilt only when their pose changes. Collision
+queries that used to scan every object, container or recompute the drawer bounds become dictionary/set lookups, with
+the same results as the corresponding functions in data_utils.
+"""
+
+from math import ceil, floor
+
+from task_sim import data_utils as DataUtils
+
+def cell_of(position):
+    """Key of the cell holding a point"""
+    return (position.x, position.y, position.z)
+
+
+def _span(vmin, vmax):
+    """Integer coordinates in [vmin, vmax] (bounds come from float message fields)"""
+    return range(int(ceil(vmin)), int(floor(vmax)) + 1)
+
+
+def _area(xmin, xmax, ymin, ymax, zmin, zmax):
+    """Cells inside a volume, matching data_utils.in_volume"""
+    return set((x, y, z) for x in _span(xmin, xmax) for y in _span(ymin, ymax) for z in _span(zmin, zmax))
+
+
+def _perimeter(xmin, xmax, ymin, ymax, zmin, zmax):
+    """Cells on the vertical walls of a volume, matching data_utils.on_box_edge"""
+    return set(
+        (x, y, z)
+        for x in _span(xmin, xmax) for y in _span(ymin, ymax) for z in _span(zmin, zmax)
+        if x == xmin or x == xmax or y == ymin or y == ymax
+    )
+
+
+class OccupancyGrid(object):
+
+    def __init__(self, state, box_radius, box_height, drawer_width, drawer_depth, drawer_height):
+        """Index a state (msg/State) for the given box and drawer dimensions
+
+        The state's object and container lists are indexed as they are now; the simulator reports later additions and
+        moves through add_object, move_object, add_container and move_container.
+        """
+        self.state = state
+        self.box_radius = box_radius
+        self.box_height = box_height
+        self.drawer_width = drawer_width
+        self.drawer_depth = drawer_depth
+        self.drawer_height = drawer_height
+
+        self.object_cells = {}  # cell -> objects in that cell, in state order
+        self.object_keys = {}  # object unique name -> cell
+        self.object_order = {}  # object unique name -> index in state.objects
+        self.container_cells = {}  # cell -> containers covering that cell, in state order
+        self.container_keys = {}  # container unique name -> cells
+        self.container_order = {}  # container unique name -> index in state.containers
+
+        # environment layers, each with the pose it was built for
+        self._box_pose = self._lid_pose = self._drawer_pose = None
+        self._box_edge = self._lid = set()
+        self._drawer_stack = self._drawer_bottom = self._drawer_edge = set()
+
+        for object in state.objects:
+            self.add_object(object)
+        for container in state.containers:
+            self.add_container(container)
+
+    # Index maintenance
+
+    def add_object(self, object):
+        """Index an object appended to the end of state.objects"""
+        self.object_order[object.unique_name] = len(self.object_order)
+        self._insert(self.object_cells, self.object_order, cell_of(object.position), object)
+        self.object_keys[object.unique_name] = cell_of(object.position)
+
+    def move_object(self, object):
+        """Re-index an object after its position changed"""
+        old = self.object_keys[object.unique_name]
+        new = cell_of(object.position)
+        if old == new:
+            return
+        self._remove(self.object_cells, old, object)
+        self._insert(self.object_cells, self.object_order, new, object)
+        self.object_keys[object.unique_name] = new
+
+    def add_container(self, container):
+        """Index a container appended to the end of state.containers"""
+        self.container_order[container.unique_name] = len(self.container_order)
+        self._index_container(container)
+
+    def move_container(self, container):
+        """Re-index a container after its position changed"""
+        for cell in self.container_keys[container.unique_name]:
+            self._remove(self.container_cells, cell, container)
+        self._index_container(container)
+
+    def _index_container(self, container):
+        cells = self._container_area(container)
+        for cell in cells:
+            self._insert(self.container_cells, self.container_order, cell, container)
+        self.container_keys[container.unique_name] = cells
+
+    def _container_area(self, container):
+        return [
+            (container.position.x + i, container.position.y + j, container.position.z)
+            for i in range(int(container.width))
+            for j in range(int(container.height))
+        ]
+
+    def _insert(self, cells, order, key, occupant):
+        occupants = cells.setdefault(key, [])
+        index = order[occupant.unique_name]
+        i = 0
+        while i < len(occupants) and order[occupants[i].unique_name] < index:
+            i += 1
+        occupants.insert(i, occupant)
+
+    def _remove(self, cells, key, occupant):
+        occupants = cells[key]
+        occupants.remove(occupant)
+        if len(occupants) == 0:
+            del cells[key]
+
+    # Environment layers
+
+    def _update_environment(self):
+        state = self.state
+        box_pose = (state.box_position.x, state.box_position.y, state.box_position.z)
+        if box_pose != self._box_pose:
+            self._box_pose = box_pose
+            self._box_edge = _perimeter(
+                state.box_position.x - self.box_radius, state.box_position.x + self.box_radius,
+                state.box_position.y - self.box_radius, state.box_position.y + self.box_radius,
+                state.box_position.z, state.box_position.z + self.box_height - 1
+            )
+
+        lid_pose = (state.lid_position.x, state.lid_position.y, state.lid_position.z)
+        if lid_pose != self._lid_pose:
+            self._lid_pose = lid_pose
+            self._lid = _area(
+                state.lid_position.x - self.box_radius, state.lid_position.x + self.box_radius,
+                state.lid_position.y - self.box_radius, state.lid_position.y + self.box_radius,
+                state.lid_position.z, state.lid_position.z
+            )
+
+        drawer_pose = (state.drawer_position.x, state.drawer_position.y, state.drawer_position.theta,
+                       state.drawer_opening)
+        if drawer_pose != self._drawer_pose:
+            self._drawer_pose = drawer_pose
+            xmin, xmax, ymin, ymax, xminDrawer, xmaxDrawer, yminDrawer, ymaxDrawer = \
+                DataUtils.get_drawer_bounds(state, self.drawer_width, self.drawer_depth)
+            self._drawer_stack = _area(xmin, xmax, ymin, ymax, 0, self.drawer_height)
+            self._drawer_bottom = _area(xminDrawer + 1, xmaxDrawer - 1, yminDrawer + 1, ymaxDrawer - 1,
+                                        self.drawer_height - 1, self.drawer_height - 1)
+            self._drawer_edge = _perimeter(xminDrawer, xmaxDrawer, yminDrawer, ymaxDrawer,
+                                           self.drawer_height - 1, self.drawer_height)
+
+    # Queries
+
+    def object_at(self, position, ignore=None):
+        """First object (in state order) at a position, skipping the object named ignore; None if there is none"""
+        for object in self.object_cells.get(cell_of(position), ()):
+            if ignore is None or object.unique_name != ignore:
+                return object
+        return None
+
+    def containers_at(self, position, ignore=None):
+        """Containers (in state order) covering a position, skipping the container named ignore"""
+        return [
+            container for container in self.container_cells.get(cell_of(position), ())
+            if ignore is None or container.unique_name != ignore
+        ]
+
+    def in_container(self, position, ignore=None):
+        """Detect whether a position is inside any container, matching data_utils.in_container"""
+        for container in self.container_cells.get(cell_of(position), ()):
+            if ignore is not None and container.unique_name in ignore:
+                continue
+            return True
+        return False
+
+    def box_collision(self, position):
+        self._update_environment()
+        return cell_of(position) in self._box_edge
+
+    def lid_collision(self, position):
+        self._update_environment()
+        return cell_of(position) in self._lid
+
+    def drawer_collision(self, position):
+        """[drawer stack collision, drawer bottom collision, drawer edge collision]"""
+        self._update_environment()
+        cell = cell_of(position)
+        return [cell in self._drawer_stack, cell in self._drawer_bottom, cell in self._drawer_edge]
+
+    def environment_collision(self, position):
+        """Detect collision with either the box, lid, or drawer"""
+        self._update_environment()
+        cell = cell_of(position)
+        return cell in self._box_edge or cell in self._lid or cell in self._drawer_stack \
+            or cell in self._drawer_bottom or cell in self._drawer_edge
+
+    def in_collision(self, position, ignore=None):
+        """Detect collision with anything in the environment (gripper not included), matching data_utils.in_collision"""
+        return self.object_at(position, ignore) or self.environment_collision(position)
@@ -3,6 +3,7 @@
 from string import digits
 
 from task_sim.msg import OOState as OOStateMsg
+from task_sim.oomdp.oomdp_batch import BatchRelations
 from task_sim.oomdp.oomdp_classes import Box, Container, Drawer, Gripper, Item, Lid, Stack
 
 reverse_relation = {
@@ -14,13 +15,181 @@ reverse_relation = {
         'below': 'above'
     }
 
+# Relation checks between groups of objects, as (group1, group2, [(predicate of group1 object, relation, sort), ...]);
+# pairs within a group are checked once, in dictionary order
+_spatial = [
+    ('touching', 'touching', False),
+    ('left_of', 'left_of', False),
+    ('right_of', 'right_of', False),
+    ('behind', 'behind', False),
+    ('in_front_of', 'in_front_of', False),
+    ('on', 'on', False),
+    ('above', 'above', False),
+    ('below', 'below', False),
+    ('level_with', 'level_with', False)
+]
+_symmetric_spatial = [(predicate, relation, relation in ('touching', 'on', 'level_with'))
+                      for predicate, relation, sort in _spatial]
+
+relation_checks = [
+    ('items', 'items', _symmetric_spatial),
+    ('items', 'containers', [('inside', 'inside', False)] + _spatial),
+    ('items', 'boxes', [('inside', 'inside', False)] + _spatial),
+    ('items', 'drawers', [('inside', 'inside', False)] + _spatial),
+    ('items', 'lids', [('atop', 'atop', False)] + _spatial),
+    ('items', 'stacks', [('atop', 'atop', False)] + _spatial),
+
+    ('containers', 'containers', [('inside', 'atop', False)] + _symmetric_spatial),
+    ('containers', 'boxes', [('atop', 'atop', False), ('inside', 'inside', False)] + _spatial),
+    ('containers', 'drawers', [('atop', 'atop', False), ('inside', 'inside', False)] + _spatial),
+    ('containers', 'lids', [('atop', 'atop', False)] + _spatial),
+    ('containers', 'stacks', [('atop', 'atop', False)] + _spatial),
+
+    ('lids', 'lids', [('inside', 'atop', False)] + _symmetric_spatial),
+    ('lids', 'boxes', [('closing', 'closing', False), ('atop', 'atop', False)] + _spatial),
+    ('lids', 'drawers', [('atop', 'atop', False)] + _spatial),
+    ('lids', 'stacks', [('atop', 'atop', False)] + _spatial),
+
+    ('drawers', 'drawers', [('touching', 'touching', True)]),
+    ('drawers', 'boxes', [('touching', 'touching', False)]),
+    ('drawers', 'stacks', [('closing', 'closing', False), ('touching', 'touching', False)]),
+
+    ('grippers', 'grippers', _symmetric_spatial),
+    ('grippers', 'items', [('inside', 'inside', False)] + _spatial),
+    ('grippers', 'containers', [('inside', 'inside', False)] + _spatial),
+    ('grippers', 'boxes', [('inside', 'inside', False)] + _spatial),
+    ('grippers', 'drawers', [('inside', 'inside', False)] + _spatial),
+    ('grippers', 'lids', _spatial),
+    ('grippers', 'stacks', _spatial)
+]
+
+checks_by_groups = dict(((group1, group2), checks) for group1, group2, checks in relation_checks)
+
+# every relation name that can appear between two object names in a relation string
+relation_vocabulary = set(relation for group1, group2, checks in relation_checks for predicate, relation, sort in checks) \
+    | set(reverse_relation.values())
+
+
+def _signature(obj):
+    """Everything a relation check can depend on for an object"""
+    return sorted((name, value) for name, value in obj.__dict__.iteritems() if name != 'relations')
+
+
+def _pair_relations(obj1, obj2, checks, batch=None):
+    """Evaluate relation checks between two objects
+
+    Keyword arguments:
+    obj1, obj2 -- objects to relate
+    checks -- list of (predicate method name of obj1, relation name, sort) tuples; sorted relations are symmetric and
+              named with the object names in alphabetical order
+    batch -- optional BatchRelations holding both objects, used for the predicates it covers
+
+    Returns:
+    (relations of obj1, relations of obj2), each a set of relation strings
+    """
+    relations1 = set()
+    relations2 = set()
+    covered = ()
+    if batch is not None:
+        covered = batch.covered.get(obj1.__class__, ())
+        i = batch.index[id(obj1)]
+        j = batch.index[id(obj2)]
+    for predicate, relation_name, sort in checks:
+        if predicate in covered:
+            if not batch.values[predicate][i][j]:
+                continue
+        elif not getattr(obj1, predicate)(obj2):
+            continue
+        if sort:
+            name_order = sorted([obj1.name, obj2.name])
+            rel = name_order[0] + '_' + relation_name + '_' + name_order[1]
+            relations1.add(rel)
+            relations2.add(rel)
+        else:
+            rel = obj1.name + '_' + relation_name + '_' + obj2.name
+            relations1.add(rel)
+            if relation_name in reverse_relation:
+                relations2.add(obj2.name + '_' + reverse_relation[relation_name] + '_' + obj1.name)
+            else:
+                relations2.add(rel)
+    return relations1, relations2
+
+
+class LazyRelations(object):
+    """Relations of an OOState that are evaluated on demand
+
+    A query such as 'apple_left_of_drawer' in relations evaluates (and memoizes) only the pairs of objects named apple
+    and drawer, so a projection that needs a few relations does not pay for all of them.  Iterating or taking the
+    length evaluates every remaining pair.  Relations of the objects themselves (obj.relations) only include the
+    pairs evaluated so far.
+    """
+
+    def __init__(self, oo_state):
+        self.oo_state = oo_state
+        self.known = set()  # relations of the pairs evaluated so far
+        self.resolved = set()  # relation strings whose pairs have all been evaluated
+        self.complete = False
+        self.objects_by_name = {}
+        for group in oo_state.groups:
+            for key, obj in getattr(oo_state, group).iteritems():
+                self.objects_by_name.setdefault(obj.name, []).append((group, key))
+
+    def update(self, relations):
+        self.known.update(relations)
+
+    def __contains__(self, relation):
+        if self.complete or relation in self.resolved:
+            return relation in self.known
+        for subject, obj in self._split(relation):
+            for group1, key1 in self.objects_by_name[subject]:
+                for group2, key2 in self.objects_by_name[obj]:
+                    self.oo_state._evaluate_between(group1, key1, group2, key2)
+        self.resolved.add(relation)
+        return relation in self.known
+
+    def __iter__(self):
+        self._evaluate_all()
+        return iter(self.known)
+
+    def __len__(self):
+        self._evaluate_all()
+        return len(self.known)
+
+    def _evaluate_all(self):
+        if not self.complete:
+            self.oo_state._evaluate_all()
+            self.complete = True
+
+    def _split(self, relation):
+        """Possible (subject name, object name) readings of a relation string"""
+        readings = []
+        for subject in self.objects_by_name:
+            if not relation.startswith(subject + '_'):
+                continue
+            rest = relation[len(subject) + 1:]
+            for obj in self.objects_by_name:
+                if rest.endswith('_' + obj) and rest[:-len(obj) - 1] in relation_vocabulary:
+                    readings.append((subject, obj))
+        return readings
+
 
 class OOState:
 
-    def __init__(self, state=None, continuous=False):
+    # object dictionaries, by attribute name
+    groups = ('boxes', 'containers', 'drawers', 'grippers', 'items', 'lids', 'stacks')
+
+    def __init__(self, state=None, continuous=False, prev=None, lazy=False):
+        """Create an object-oriented state, optionally from a State message
+
+        Keyword arguments:
+        state -- State message to initialize from
+        continuous -- whether the state comes from the real robot
+        prev -- OOState of an earlier State message; relations of unchanged objects are reused from it
+        lazy -- if True, relations are only evaluated when queried (see LazyRelations)
+        """
         self.clear_state()
         if state is not None:
-            self.init_from_state(state, continuous)
+            self.init_from_state(state, continuous, prev, lazy)
 
     def clear_state(self):
         self.boxes = {}
@@ -30,9 +199,11 @@ class OOState:
         self.items = {}
         self.lids = {}
         self.stacks = {}
-        self.relations = []
+        self.relations = set()
+        self.pair_relations = None  # (group1, key1, group2, key2) -> (relations of obj1, relations of obj2)
+        self.relation_count = None
 
-    def init_from_state(self, state, continuous=False):
+    def init_from_state(self, state, continuous=False, prev=None, lazy=False):
         self.clear_state()
 
         for o in state.objects:
@@ -78,380 +249,118 @@ class OOState:
             stack = Stack(state.drawer_position.x, state.drawer_position.y, name='stack', unique_name='stack')
         self.stacks[stack.unique_name] = stack
 
-        self.calculate_relations()
+        self._calculate_relations(prev, lazy)
 
     def calculate_relations(self):
         """Calculate all relations between all objects
 
         Note: this will clear any current relations and recalculate
         """
+        self._calculate_relations()
+
+    def update_from_state(self, prev, state, continuous=False, lazy=False):
+        """Set this OOState from a State message, reusing the relations of a previous OOState where possible
+
+        Only the pairs involving an object whose attributes (pose, size, gripper status, ...) differ from prev are
+        re-evaluated; the relations of every other pair are copied from prev.  The result is the same as
+        init_from_state(state, continuous).
+
+        Keyword arguments:
+        prev -- OOState computed from an earlier State message (e.g. the previous step); None for a full calculation
+        state -- State message
+        continuous -- whether the state comes from the real robot (see init_from_state)
+        lazy -- if True, relations are only evaluated when queried (see LazyRelations)
+        """
+        self.init_from_state(state, continuous, prev, lazy)
+        return self
+
+    def _calculate_relations(self, prev=None, lazy=False):
+        """Evaluate the relation checks for every pair of objects (or set up lazy evaluation), reusing the results of
+        pairs unchanged from prev"""
         self.clear_relations()
 
-        self.relation_count = 0
+        # results of pairs whose objects are unchanged since prev, moved over to pair_relations as they are needed
+        self._reusable = {}
+        if prev is not None and getattr(prev, 'pair_relations', None) is not None:
+            dirty = set()
+            for group in self.groups:
+                current = getattr(self, group)
+                previous = getattr(prev, group)
+                for key, obj in current.iteritems():
+                    if key not in previous or _signature(previous[key]) != _signature(obj):
+                        dirty.add((group, key))
+            for pair, relations in prev.pair_relations.iteritems():
+                if (pair[0], pair[1]) not in dirty and (pair[2], pair[3]) not in dirty:
+                    self._reusable[pair] = relations
+            for pair, relations in getattr(prev, '_reusable', {}).iteritems():
+                if pair not in self._reusable and (pair[0], pair[1]) not in dirty and (pair[2], pair[3]) not in dirty:
+                    self._reusable[pair] = relations
 
-        def add_relation(obj1, obj2, result, relation_name, sort=False):
-            self.relation_count += 1
-            reverse = None
-            rel = None
-            if sort:
-                name_order = sorted([obj1.name, obj2.name])
-                if result:
-                    rel = name_order[0] + '_' + relation_name + '_' + name_order[1]
-            else:
-                if result:
-                    rel = obj1.name + '_' + relation_name + '_' + obj2.name
-                    if relation_name in reverse_relation:
-                        reverse = obj2.name + '_' + reverse_relation[relation_name] + '_' + obj1.name
-
-            if rel is not None and rel not in self.relations:
-                self.relations.append(rel)
-
-            if rel is not None and rel not in obj1.relations:
-                obj1.relations.append(rel)
-
-            if reverse is not None:
-                if reverse not in self.relations:
-                    self.relations.append(reverse)
-                if reverse not in obj2.relations:
-                    obj2.relations.append(reverse)
-            else:
-                if rel is not None and rel not in obj2.relations:
-                    obj2.relations.append(rel)
-
-        for i in range(len(self.items)):
-            item = self.items[self.items.keys()[i]]
-            # item-item relations
-            for j in range(i + 1, len(self.items)):
-                item2 = self.items[self.items.keys()[j]]
-                add_relation(item, item2, item.touching(item2), 'touching', sort=True)
-                add_relation(item, item2, item.left_of(item2), 'left_of')
-                add_relation(item, item2, item.right_of(item2), 'right_of')
-                add_relation(item, item2, item.behind(item2), 'behind')
-                add_relation(item, item2, item.in_front_of(item2), 'in_front_of')
-                add_relation(item, item2, item.on(item2), 'on', sort=True)
-                add_relation(item, item2, item.above(item2), 'above')
-                add_relation(item, item2, item.below(item2), 'below')
-                add_relation(item, item2, item.level_with(item2), 'level_with', sort=True)
-
-            # item-container relations
-            for c in self.containers.values():
-                add_relation(item, c, item.inside(c), 'inside')
-                add_relation(item, c, item.touching(c), 'touching')
-                add_relation(item, c, item.left_of(c), 'left_of')
-                add_relation(item, c, item.right_of(c), 'right_of')
-                add_relation(item, c, item.behind(c), 'behind')
-                add_relation(item, c, item.in_front_of(c), 'in_front_of')
-                add_relation(item, c, item.on(c), 'on')
-                add_relation(item, c, item.above(c), 'above')
-                add_relation(item, c, item.below(c), 'below')
-                add_relation(item, c, item.level_with(c), 'level_with')
-
-            # item-box relations
-            for b in self.boxes.values():
-                add_relation(item, b, item.inside(b), 'inside')
-                add_relation(item, b, item.touching(b), 'touching')
-                add_relation(item, b, item.left_of(b), 'left_of')
-                add_relation(item, b, item.right_of(b), 'right_of')
-                add_relation(item, b, item.behind(b), 'behind')
-                add_relation(item, b, item.in_front_of(b), 'in_front_of')
-                add_relation(item, b, item.on(b), 'on')
-                add_relation(item, b, item.above(b), 'above')
-                add_relation(item, b, item.below(b), 'below')
-                add_relation(item, b, item.level_with(b), 'level_with')
-
-            # item-drawer relations
-            for d in self.drawers.values():
-                add_relation(item, d, item.inside(d), 'inside')
-                add_relation(item, d, item.touching(d), 'touching')
-                add_relation(item, d, item.left_of(d), 'left_of')
-                add_relation(item, d, item.right_of(d), 'right_of')
-                add_relation(item, d, item.behind(d), 'behind')
-                add_relation(item, d, item.in_front_of(d), 'in_front_of')
-                add_relation(item, d, item.on(d), 'on')
-                add_relation(item, d, item.above(d), 'above')
-                add_relation(item, d, item.below(d), 'below')
-                add_relation(item, d, item.level_with(d), 'level_with')
-
-            # item-lid relations
-            for l in self.lids.values():
-                add_relation(item, l, item.atop(l), 'atop')
-                add_relation(item, l, item.touching(l), 'touching')
-                add_relation(item, l, item.left_of(l), 'left_of')
-                add_relation(item, l, item.right_of(l), 'right_of')
-                add_relation(item, l, item.behind(l), 'behind')
-                add_relation(item, l, item.in_front_of(l), 'in_front_of')
-                add_relation(item, l, item.on(l), 'on')
-                add_relation(item, l, item.above(l), 'above')
-                add_relation(item, l, item.below(l), 'below')
-                add_relation(item, l, item.level_with(l), 'level_with')
-
-            # item-stack relations
-            for s in self.stacks.values():
-                add_relation(item, s, item.atop(s), 'atop')
-                add_relation(item, s, item.touching(s), 'touching')
-                add_relation(item, s, item.left_of(s), 'left_of')
-                add_relation(item, s, item.right_of(s), 'right_of')
-                add_relation(item, s, item.behind(s), 'behind')
-                add_relation(item, s, item.in_front_of(s), 'in_front_of')
-                add_relation(item, s, item.on(s), 'on')
-                add_relation(item, s, item.above(s), 'above')
-                add_relation(item, s, item.below(s), 'below')
-                add_relation(item, s, item.level_with(s), 'level_with')
-
-        for i in range(len(self.containers)):
-            container = self.containers[self.containers.keys()[i]]
-
-            # container-container relations
-            for j in range(i + 1, len(self.containers)):
-                container2 = self.containers[self.containers.keys()[j]]
-                add_relation(container, container2, container.inside(container2), 'atop')
-                add_relation(container, container2, container.touching(container2), 'touching', sort=True)
-                add_relation(container, container2, container.left_of(container2), 'left_of')
-                add_relation(container, container2, container.right_of(container2), 'right_of')
-                add_relation(container, container2, container.behind(container2), 'behind')
-                add_relation(container, container2, container.in_front_of(container2), 'in_front_of')
-                add_relation(container, container2, container.on(container2), 'on', sort=True)
-                add_relation(container, container2, container.above(container2), 'above')
-                add_relation(container, container2, container.below(container2), 'below')
-                add_relation(container, container2, container.level_with(container2), 'level_with', sort=True)
-
-            # container-box relations
-            for b in self.boxes.values():
-                add_relation(container, b, container.atop(b), 'atop')
-                add_relation(container, b, container.inside(b), 'inside')
-                add_relation(container, b, container.touching(b), 'touching')
-                add_relation(container, b, container.left_of(b), 'left_of')
-                add_relation(container, b, container.right_of(b), 'right_of')
-                add_relation(container, b, container.behind(b), 'behind')
-                add_relation(container, b, container.in_front_of(b), 'in_front_of')
-                add_relation(container, b, container.on(b), 'on')
-                add_relation(container, b, container.above(b), 'above')
-                add_relation(container, b, container.below(b), 'below')
-                add_relation(container, b, container.level_with(b), 'level_with')
-
-            # container-drawer relations
-            for d in self.drawers.values():
-                add_relation(container, d, container.atop(d), 'atop')
-                add_relation(container, d, container.inside(d), 'inside')
-                add_relation(container, d, container.touching(d), 'touching')
-                add_relation(container, d, container.left_of(d), 'left_of')
-                add_relation(container, d, container.right_of(d), 'right_of')
-                add_relation(container, d, container.behind(d), 'behind')
-                add_relation(container, d, container.in_front_of(d), 'in_front_of')
-                add_relation(container, d, container.on(d), 'on')
-                add_relation(container, d, container.above(d), 'above')
-                add_relation(container, d, container.below(d), 'below')
-                add_relation(container, d, container.level_with(d), 'level_with')
-
-            # container-lid relations
-            for l in self.lids.values():
-                add_relation(container, l, container.atop(l), 'atop')
-                add_relation(container, l, container.touching(l), 'touching')
-                add_relation(container, l, container.left_of(l), 'left_of')
-                add_relation(container, l, container.right_of(l), 'right_of')
-                add_relation(container, l, container.behind(l), 'behind')
-                add_relation(container, l, container.in_front_of(l), 'in_front_of')
-                add_relation(container, l, container.on(l), 'on')
-                add_relation(container, l, container.above(l), 'above')
-                add_relation(container, l, container.below(l), 'below')
-                add_relation(container, l, container.level_with(l), 'level_with')
-
-            # container-stack relations
-            for s in self.stacks.values():
-                add_relation(container, s, container.atop(s), 'atop')
-                add_relation(container, s, container.touching(s), 'touching')
-                add_relation(container, s, container.left_of(s), 'left_of')
-                add_relation(container, s, container.right_of(s), 'right_of')
-                add_relation(container, s, container.behind(s), 'behind')
-                add_relation(container, s, container.in_front_of(s), 'in_front_of')
-                add_relation(container, s, container.on(s), 'on')
-                add_relation(container, s, container.above(s), 'above')
-                add_relation(container, s, container.below(s), 'below')
-                add_relation(container, s, container.level_with(s), 'level_with')
-
-        for i in range(len(self.lids)):
-            lid = self.lids[self.lids.keys()[i]]
-
-            # lid-lid relations
-            for j in range(i + 1, len(self.lids)):
-                lid2 = self.lids[self.lids.keys()[j]]
-                add_relation(lid, lid2, lid.inside(lid2), 'atop')
-                add_relation(lid, lid2, lid.touching(lid2), 'touching', sort=True)
-                add_relation(lid, lid2, lid.left_of(lid2), 'left_of')
-                add_relation(lid, lid2, lid.right_of(lid2), 'right_of')
-                add_relation(lid, lid2, lid.behind(lid2), 'behind')
-                add_relation(lid, lid2, lid.in_front_of(lid2), 'in_front_of')
-                add_relation(lid, lid2, lid.on(lid2), 'on', sort=True)
-                add_relation(lid, lid2, lid.above(lid2), 'above')
-                add_relation(lid, lid2, lid.below(lid2), 'below')
-                add_relation(lid, lid2, lid.level_with(lid2), 'level_with', sort=True)
-
-            # lid-box relations
-            for b in self.boxes.values():
-                add_relation(lid, b, lid.closing(b), 'closing')
-                add_relation(lid, b, lid.atop(b), 'atop')
-                add_relation(lid, b, lid.touching(b), 'touching')
-                add_relation(lid, b, lid.left_of(b), 'left_of')
-                add_relation(lid, b, lid.right_of(b), 'right_of')
-                add_relation(lid, b, lid.behind(b), 'behind')
-                add_relation(lid, b, lid.in_front_of(b), 'in_front_of')
-                add_relation(lid, b, lid.on(b), 'on')
-                add_relation(lid, b, lid.above(b), 'above')
-                add_relation(lid, b, lid.below(b), 'below')
-                add_relation(lid, b, lid.level_with(b), 'level_with')
-
-            # lid-drawer relations
-            for d in self.drawers.values():
-                add_relation(lid, d, lid.atop(d), 'atop')
-                add_relation(lid, d, lid.touching(d), 'touching')
-                add_relation(lid, d, lid.left_of(d), 'left_of')
-                add_relation(lid, d, lid.right_of(d), 'right_of')
-                add_relation(lid, d, lid.behind(d), 'behind')
-                add_relation(lid, d, lid.in_front_of(d), 'in_front_of')
-                add_relation(lid, d, lid.on(d), 'on')
-                add_relation(lid, d, lid.above(d), 'above')
-                add_relation(lid, d, lid.below(d), 'below')
-                add_relation(lid, d, lid.level_with(d), 'level_with')
-
-            # lid-stack relations
-            for s in self.stacks.values():
-                add_relation(lid, s, lid.atop(s), 'atop')
-                add_relation(lid, s, lid.touching(s), 'touching')
-                add_relation(lid, s, lid.left_of(s), 'left_of')
-                add_relation(lid, s, lid.right_of(s), 'right_of')
-                add_relation(lid, s, lid.behind(s), 'behind')
-                add_relation(lid, s, lid.in_front_of(s), 'in_front_of')
-                add_relation(lid, s, lid.on(s), 'on')
-                add_relation(lid, s, lid.above(s), 'above')
-                add_relation(lid, s, lid.below(s), 'below')
-                add_relation(lid, s, lid.level_with(s), 'level_with')
-
-        for i in range(len(self.drawers)):
-            drawer = self.drawers[self.drawers.keys()[i]]
-
-            # drawer-drawer relations
-            for j in range(i + 1, len(self.drawers)):
-                drawer2 = self.drawers[self.drawers.keys()[j]]
-                add_relation(drawer, drawer2, drawer.touching(drawer2), 'touching', sort=True)
-
-            # drawer-box relations
-            for b in self.boxes.values():
-                add_relation(drawer, b, drawer.touching(b), 'touching')
-
-            # drawer-stack relations
-            for s in self.stacks.values():
-                add_relation(drawer, s, drawer.closing(s), 'closing')
-                add_relation(drawer, s, drawer.touching(s), 'touching')
-
-        for i in range(len(self.grippers)):
-            gripper = self.grippers[self.grippers.keys()[i]]
-
-            # gripper-gripper relations
-            for j in range(i + 1, len(self.grippers)):
-                gripper2 = self.grippers[self.grippers.keys()[j]]
-                add_relation(gripper, gripper2, gripper.touching(gripper2), 'touching', sort=True)
-                add_relation(gripper, gripper2, gripper.left_of(gripper2), 'left_of')
-                add_relation(gripper, gripper2, gripper.right_of(gripper2), 'right_of')
-                add_relation(gripper, gripper2, gripper.behind(gripper2), 'behind')
-                add_relation(gripper, gripper2, gripper.in_front_of(gripper2), 'in_front_of')
-                add_relation(gripper, gripper2, gripper.on(gripper2), 'on', sort=True)
-                add_relation(gripper, gripper2, gripper.above(gripper2), 'above')
-                add_relation(gripper, gripper2, gripper.below(gripper2), 'below')
-                add_relation(gripper, gripper2, gripper.level_with(gripper2), 'level_with', sort=True)
-
-            # gripper-item relations
-            for item in self.items.values():
-                add_relation(gripper, item, gripper.inside(item), 'inside')
-                add_relation(gripper, item, gripper.touching(item), 'touching')
-                add_relation(gripper, item, gripper.left_of(item), 'left_of')
-                add_relation(gripper, item, gripper.right_of(item), 'right_of')
-                add_relation(gripper, item, gripper.behind(item), 'behind')
-                add_relation(gripper, item, gripper.in_front_of(item), 'in_front_of')
-                add_relation(gripper, item, gripper.on(item), 'on')
-                add_relation(gripper, item, gripper.above(item), 'above')
-                add_relation(gripper, item, gripper.below(item), 'below')
-                add_relation(gripper, item, gripper.level_with(item), 'level_with')
-
-            # gripper-container relations
-            for c in self.containers.values():
-                add_relation(gripper, c, gripper.inside(c), 'inside')
-                add_relation(gripper, c, gripper.touching(c), 'touching')
-                add_relation(gripper, c, gripper.left_of(c), 'left_of')
-                add_relation(gripper, c, gripper.right_of(c), 'right_of')
-                add_relation(gripper, c, gripper.behind(c), 'behind')
-                add_relation(gripper, c, gripper.in_front_of(c), 'in_front_of')
-                add_relation(gripper, c, gripper.on(c), 'on')
-                add_relation(gripper, c, gripper.above(c), 'above')
-                add_relation(gripper, c, gripper.below(c), 'below')
-                add_relation(gripper, c, gripper.level_with(c), 'level_with')
-
-            # gripper-box relations
-            for b in self.boxes.values():
-                add_relation(gripper, b, gripper.inside(b), 'inside')
-                add_relation(gripper, b, gripper.touching(b), 'touching')
-                add_relation(gripper, b, gripper.left_of(b), 'left_of')
-                add_relation(gripper, b, gripper.right_of(b), 'right_of')
-                add_relation(gripper, b, gripper.behind(b), 'behind')
-                add_relation(gripper, b, gripper.in_front_of(b), 'in_front_of')
-                add_relation(gripper, b, gripper.on(b), 'on')
-                add_relation(gripper, b, gripper.above(b), 'above')
-                add_relation(gripper, b, gripper.below(b), 'below')
-                add_relation(gripper, b, gripper.level_with(b), 'level_with')
-
-            # item-drawer relations
-            for d in self.drawers.values():
-                add_relation(gripper, d, gripper.inside(d), 'inside')
-                add_relation(gripper, d, gripper.touching(d), 'touching')
-                add_relation(gripper, d, gripper.left_of(d), 'left_of')
-                add_relation(gripper, d, gripper.right_of(d), 'right_of')
-                add_relation(gripper, d, gripper.behind(d), 'behind')
-                add_relation(gripper, d, gripper.in_front_of(d), 'in_front_of')
-                add_relation(gripper, d, gripper.on(d), 'on')
-                add_relation(gripper, d, gripper.above(d), 'above')
-                add_relation(gripper, d, gripper.below(d), 'below')
-                add_relation(gripper, d, gripper.level_with(d), 'level_with')
-
-            # item-lid relations
-            for l in self.lids.values():
-                add_relation(gripper, l, gripper.touching(l), 'touching')
-                add_relation(gripper, l, gripper.left_of(l), 'left_of')
-                add_relation(gripper, l, gripper.right_of(l), 'right_of')
-                add_relation(gripper, l, gripper.behind(l), 'behind')
-                add_relation(gripper, l, gripper.in_front_of(l), 'in_front_of')
-                add_relation(gripper, l, gripper.on(l), 'on')
-                add_relation(gripper, l, gripper.above(l), 'above')
-                add_relation(gripper, l, gripper.below(l), 'below')
-                add_relation(gripper, l, gripper.level_with(l), 'level_with')
-
-            # item-stack relations
-            for s in self.stacks.values():
-                add_relation(gripper, s, gripper.touching(s), 'touching')
-                add_relation(gripper, s, gripper.left_of(s), 'left_of')
-                add_relation(gripper, s, gripper.right_of(s), 'right_of')
-                add_relation(gripper, s, gripper.behind(s), 'behind')
-                add_relation(gripper, s, gripper.in_front_of(s), 'in_front_of')
-                add_relation(gripper, s, gripper.on(s), 'on')
-                add_relation(gripper, s, gripper.above(s), 'above')
-                add_relation(gripper, s, gripper.below(s), 'below')
-                add_relation(gripper, s, gripper.level_with(s), 'level_with')
+        self.relation_count = 0
+        self.pair_relations = {}
+        if lazy:
+            self.relations = LazyRelations(self)
+        else:
+            self._evaluate_all()
+
+    def _evaluate_all(self):
+        """Evaluate every pair of objects that has not been evaluated yet"""
+        # with nothing evaluated or reusable yet, the covered predicates are cheaper to evaluate in one pass
+        batch = None
+        if len(self.pair_relations) == 0 and len(self._reusable) == 0:
+            batch = BatchRelations([obj for group in self.groups for obj in getattr(self, group).values()])
+        for group1, group2, checks in relation_checks:
+            keys1 = getattr(self, group1).keys()
+            for i in range(len(keys1)):
+                if group1 == group2:
+                    keys2 = keys1[i + 1:]
+                else:
+                    keys2 = getattr(self, group2).keys()
+                for key2 in keys2:
+                    self._evaluate_pair(group1, keys1[i], group2, key2, checks, batch)
+        self._reusable = {}
+
+    def _evaluate_pair(self, group1, key1, group2, key2, checks, batch=None):
+        """Relations of one pair of objects, evaluated (or reused from the previous state) on first use"""
+        pair = (group1, key1, group2, key2)
+        relations = self.pair_relations.get(pair)
+        if relations is None:
+            obj1 = getattr(self, group1)[key1]
+            obj2 = getattr(self, group2)[key2]
+            self.relation_count += len(checks)
+            relations = self._reusable.pop(pair, None)
+            if relations is None:
+                relations = _pair_relations(obj1, obj2, checks, batch)
+            self.pair_relations[pair] = relations
+            obj1.relations.update(relations[0])
+            obj2.relations.update(relations[1])
+            self.relations.update(relations[0])
+            self.relations.update(relations[1])
+        return relations
+
+    def _evaluate_between(self, group1, key1, group2, key2):
+        """Evaluate the pair of two objects, in whichever order relation_checks relates them (if at all)"""
+        if group1 == group2:
+            if key1 == key2 or (group1, group1) not in checks_by_groups:
+                return
+            keys = getattr(self, group1).keys()
+            if keys.index(key1) > keys.index(key2):
+                key1, key2 = key2, key1
+        elif (group1, group2) not in checks_by_groups:
+            if (group2, group1) not in checks_by_groups:
+                return
+            group1, key1, group2, key2 = group2, key2, group1, key1
+        self._evaluate_pair(group1, key1, group2, key2, checks_by_groups[(group1, group2)])
 
     def clear_relations(self):
-        self.relations = []
-
-        for b in self.boxes.values():
-            b.relations = []
-        for c in self.containers.values():
-            c.relations = []
-        for d in self.drawers.values():
-            d.relations = []
-        for g in self.grippers.values():
-            g.relations = []
-        for i in self.items.values():
-            i.relations = []
-        for l in self.lids.values():
-            l.relations = []
-        for s in self.stacks.values():
-            s.relations = []
+        self.relations = set()
+        self.pair_relations = None
+        self.relation_count = None
+        self._reusable = {}
+
+        for group in self.groups:
+            for obj in getattr(self, group).values():
+                obj.relations = set()
 
     def to_ros(self):
         msg = OOStateMsg()
@@ -477,7 +386,7 @@ class OOState:
         for obj in self.stacks.values():
             msg.stacks.append(obj.to_ros())
 
-        msg.relations = self.relations
+        msg.relations = sorted(self.relations)
         return msg
 
     def from_ros(self, msg):
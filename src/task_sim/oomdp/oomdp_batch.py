@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+
+"""Vectorized evaluation of the spatial relations in oomdp_classes.
+
+The directional (left_of, right_of, behind, in_front_of, on) and vertical (above, below, level_with) relations of
+every class reduce to comparing one coordinate of the subject against a threshold of the object, and touching for
+items and grippers reduces to a box test; BatchRelations evaluates these for all pairs of a list of objects at once,
+with the same (discrete or continuous) geometry as the per-pair methods.  Relations that are not covered (inside,
+atop, closing, touching for the other classes) are left to the per-pair methods.
+"""
+
+import numpy as np
+
+from task_sim.oomdp.oomdp_classes import Box, Container, Drawer, Gripper, Item, Lid, Stack
+
+directional_relations = ('left_of', 'right_of', 'behind', 'in_front_of', 'above', 'below')
+
+
+def _subject_extents(subject):
+    """Coordinates of a subject compared against the thresholds of _object_thresholds, in directional_relations order"""
+    if subject.__class__ == Container:
+        return (subject.x + subject.width - 1, subject.x, subject.y, subject.y + subject.depth - 1,
+                subject.z, subject.z)
+    if subject.__class__ == Lid:
+        return (subject.x + subject.radius, subject.x - subject.radius, subject.y - subject.radius,
+                subject.y + subject.radius, subject.z, subject.z)
+    return subject.x, subject.x, subject.y, subject.y, subject.z, subject.z
+
+
+def _object_thresholds(subject_class, continuous, obj):
+    """Thresholds of an object for each of directional_relations, as computed by the methods of subject_class"""
+    cls = obj.__class__
+    if subject_class == Container:
+        continuous = False
+
+    # left_of
+    if cls == Box or cls == Lid:
+        left = obj.x - obj.radius
+        if continuous and subject_class != Lid:
+            left -= 0.1
+    elif cls == Drawer or cls == Stack:
+        left = obj.x - obj.width/2.0 if continuous else obj.x - (obj.width - 1)/2
+    else:
+        left = obj.x - 0.1 if continuous else obj.x
+
+    # right_of
+    if cls == Box or cls == Lid:
+        right = obj.x + obj.radius
+        if continuous and subject_class != Lid:
+            right += 0.1
+    elif cls == Container:
+        right = obj.x + obj.width - 1
+    elif cls == Drawer or cls == Stack:
+        right = obj.x + obj.width/2.0 if continuous else obj.x + (obj.width - 1)/2
+    else:
+        right = obj.x + 0.1 if continuous else obj.x
+
+    # behind (items and grippers treat a stack like a point)
+    if cls == Box or cls == Lid:
+        behind = obj.y + obj.radius
+        if continuous and subject_class != Lid:
+            behind += 0.1
+    elif cls == Container:
+        behind = obj.y + obj.depth - 1
+    elif cls == Drawer or (cls == Stack and subject_class in (Container, Lid)):
+        behind = obj.y + obj.depth/2.0 if continuous else obj.y + (obj.depth - 1)/2
+    elif subject_class == Lid:
+        behind = obj.y - 0.1 if continuous else obj.y
+    else:
+        behind = obj.y + 0.1 if continuous else obj.y
+
+    # in_front_of
+    if cls == Box or cls == Lid:
+        front = obj.y - obj.radius
+        if continuous and subject_class != Lid:
+            front -= 0.1
+    elif cls == Drawer or cls == Stack:
+        front = obj.y - obj.depth/2.0 if continuous else obj.y - (obj.depth - 1)/2
+    elif subject_class == Lid:
+        front = obj.y + 0.1 if continuous else obj.y
+    else:
+        front = obj.y - 0.1 if continuous else obj.y
+
+    # above
+    if cls == Box:
+        above = .23 if continuous else 1
+    elif cls == Drawer or cls == Stack:
+        above = .254 if continuous else 2
+    else:
+        above = obj.z + 0.1 if continuous else obj.z
+
+    # below
+    if cls == Box or cls == Stack:
+        below = 0
+    elif cls == Drawer:
+        below = 0.1524 if continuous else 1
+    else:
+        below = obj.z - 0.1 if continuous else obj.z
+
+    return left, right, behind, front, above, below
+
+
+# touching test for items and grippers: 0 -- box test, 1 -- distance to a box rim, 2 -- distance to a lid rim
+_BOX_TEST, _BOX_RIM, _LID_RIM = 0, 1, 2
+
+
+def _touching_region(continuous, obj):
+    """Region an item or gripper must neighbor to touch an object, as (test, x_min, x_max, y_min, y_max, z_min, z_max)"""
+    cls = obj.__class__
+    if cls == Box:
+        if continuous:
+            return _BOX_RIM, obj.x, obj.radius, obj.y, 0, 0, 0.178
+        return _BOX_TEST, obj.x - obj.radius, obj.x + obj.radius, obj.y - obj.radius, obj.y + obj.radius, 0, 1
+    if cls == Container:
+        return _BOX_TEST, obj.x, obj.x + obj.width - 1, obj.y, obj.y + obj.depth - 1, obj.z, obj.z
+    if cls == Drawer or cls == Stack:
+        if continuous:
+            w = obj.width/2.0
+            d = obj.depth/2.0
+            z_min = 0.1524 if cls == Drawer else 0.0
+            z_max = 0.254
+        else:
+            w = (obj.width - 1)/2
+            d = (obj.depth - 1)/2
+            z_min = 1 if cls == Drawer else 0
+            z_max = 2
+        return _BOX_TEST, obj.x - w, obj.x + w, obj.y - d, obj.y + d, z_min, z_max
+    if cls == Lid:
+        if continuous:
+            return _LID_RIM, obj.x, obj.radius, obj.y, 0, obj.z - 0.05, obj.z + 0.05
+        return _BOX_TEST, obj.x - obj.radius, obj.x + obj.radius, obj.y - obj.radius, obj.y + obj.radius, obj.z, obj.z
+    if continuous:
+        return _BOX_TEST, obj.x, obj.x, obj.y, obj.y, obj.z - 0.05, obj.z + 0.05
+    return _BOX_TEST, obj.x, obj.x, obj.y, obj.y, obj.z, obj.z
+
+
+class BatchRelations:
+
+    def __init__(self, objects):
+        """Evaluate the supported relations between every (ordered) pair of a list of objects
+
+        Keyword arguments:
+        objects -- list of oomdp_classes objects; a pair is looked up with value(relation, subject, obj)
+        """
+        self.index = dict((id(obj), i) for i, obj in enumerate(objects))
+        self.matrices = {}  # relation -> boolean matrix, indexed [subject, object]
+        self.covered = {}  # class -> relations whose method is replaced by the matrices for subjects of that class
+        self.values = {}  # relation -> matrix as nested lists, for fast lookup of single pairs
+        n = len(objects)
+        if n == 0:
+            return
+
+        # directional relations, for every subject class that has them
+        directional_classes = (Item, Gripper, Container, Lid)
+        kinds = []
+        kind_of = np.zeros(n, dtype=int)
+        extents = np.zeros((n, len(directional_relations)))
+        for i, subject in enumerate(objects):
+            if subject.__class__ not in directional_classes:
+                continue
+            kind = (subject.__class__, getattr(subject, 'continuous', False))
+            if kind not in kinds:
+                kinds.append(kind)
+            kind_of[i] = kinds.index(kind)
+            extents[i] = _subject_extents(subject)
+        if kinds:
+            thresholds = np.array([[_object_thresholds(subject_class, continuous, obj) for obj in objects]
+                                   for subject_class, continuous in kinds])[kind_of]
+            left_of = extents[:, 0, None] < thresholds[:, :, 0]
+            right_of = extents[:, 1, None] > thresholds[:, :, 1]
+            behind = extents[:, 2, None] > thresholds[:, :, 2]
+            in_front_of = extents[:, 3, None] < thresholds[:, :, 3]
+            above = extents[:, 4, None] > thresholds[:, :, 4]
+            below = extents[:, 5, None] < thresholds[:, :, 5]
+            self.matrices.update({
+                'left_of': left_of, 'right_of': right_of, 'behind': behind, 'in_front_of': in_front_of,
+                'on': ~(left_of | right_of | behind | in_front_of),
+                'above': above, 'below': below, 'level_with': ~(above | below)
+            })
+            for subject_class in directional_classes:
+                self.covered[subject_class] = set(self.matrices)
+
+        # touching, for items and grippers
+        touching = np.zeros((n, n), dtype=bool)
+        for continuous in (False, True):
+            rows = [i for i, subject in enumerate(objects) if subject.__class__ in (Item, Gripper)
+                    and getattr(subject, 'continuous', False) == continuous]
+            if rows:
+                touching[rows] = self._touching(continuous, [objects[i] for i in rows], objects)
+        self.matrices['touching'] = touching
+        for subject_class in (Item, Gripper):
+            self.covered.setdefault(subject_class, set()).add('touching')
+
+        for relation, matrix in self.matrices.iteritems():
+            self.values[relation] = matrix.tolist()
+
+    def _touching(self, continuous, subjects, objects):
+        regions = np.array([_touching_region(continuous, obj) for obj in objects], dtype=float)
+        test = regions[:, 0]
+        x_min, x_max, y_min, y_max, z_min, z_max = [regions[:, k] for k in range(1, 7)]
+        x = np.array([s.x for s in subjects], dtype=float)[:, None]
+        y = np.array([s.y for s in subjects], dtype=float)[:, None]
+        z = np.array([s.z for s in subjects], dtype=float)[:, None]
+        in_z = (z_min <= z) & (z <= z_max)
+        if not continuous:
+            # some offset i, j in [-1, 1] puts (x + i, y + j) in the box
+            reach_x = np.maximum(np.ceil(x_min - x), -1) <= np.minimum(np.floor(x_max - x), 1)
+            reach_y = np.maximum(np.ceil(y_min - y), -1) <= np.minimum(np.floor(y_max - y), 1)
+            return in_z & reach_x & reach_y
+        dx = np.maximum(np.maximum(x_min - x, 0), x - x_max)
+        dy = np.maximum(np.maximum(y_min - y, 0), y - y_max)
+        near_box = in_z & (np.sqrt(dx*dx + dy*dy) < .1)
+        # rims: the x/y bounds hold the center and radius
+        rim = np.abs(np.sqrt((x_min - x)**2 + (y_min - y)**2) - x_max) <= 0.1
+        return np.where(test == _BOX_TEST, near_box,
+                        np.where(test == _BOX_RIM, (z <= z_max) & rim, in_z & rim))
+
+    def covers(self, relation, subject):
+        """True if the relation is evaluated for subjects of this class"""
+        return relation in self.covered.get(subject.__class__, ())
+
+    def value(self, relation, subject, obj):
+        """Value of a covered relation between two of the objects"""
+        return self.values[relation][self.index[id(subject)]][self.index[id(obj)]]
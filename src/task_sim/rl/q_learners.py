@@ -274,6 +274,10 @@ class EpsilonGreedyQTiledAgent(QLearningAgent):
         self.Q = np.zeros((tiles_max_size,), dtype=np.float)
         self.missing_param_value = missing_param_value
 
+        # (state, actions) and the tile index matrix of the last batch of
+        # state-actions tiled, see _tile_actions
+        self._tiled_actions = None
+
         if epsilon:
             self.epsilon = epsilon
         else:
@@ -289,6 +293,26 @@ class EpsilonGreedyQTiledAgent(QLearningAgent):
             readonly # readonly
         )
 
+    def _tile_actions(self, state, actions):
+        """Tile a state with each of a list of actions, as a matrix with a row
+        of tile indices per action. The last result is kept: the actions of
+        the next state are tiled for the TD target in update_Q, then again to
+        choose the next action"""
+        key = (state, tuple(tuple(action) for action in actions))
+        if self._tiled_actions is None or self._tiled_actions[0] != key:
+            tiled = self.tile_coder.tiles_batch(
+                self.IHT, # ihtORsize
+                self.num_tiles, # numtilings
+                [state] * len(actions), # floats
+                actions # ints
+            )
+            self._tiled_actions = (key, tiled)
+        return self._tiled_actions[1]
+
+    def _action_values(self, state, actions):
+        """Q values of each of a list of actions in a state, as an array"""
+        return np.sum(self.Q[self._tile_actions(state, actions)], axis=1)
+
     def actions_in_state(self, state):
         actions = super(EpsilonGreedyQTiledAgent, self).actions_in_state(state)
 
@@ -335,7 +359,9 @@ class EpsilonGreedyQTiledAgent(QLearningAgent):
 
         # Fetch the best action if we are training, or if the current state that
         # we see now has been seen before
-        best_action = max(action_candidates, key=lambda a: np.sum(self.Q[self._tile_sa(self.s, a)]))
+        best_action = action_candidates[
+            np.argmax(self._action_values(self.s, action_candidates))
+        ]
 
         # If we're training, use epsilon to decide if we want to explore.
         # Otherwise, pick the best
@@ -364,7 +390,7 @@ class EpsilonGreedyQTiledAgent(QLearningAgent):
         elif sa_tiled is not None:
             Q[sa_tiled] += self.alpha(episode) * (
                 r
-                + (gamma * max(np.sum(Q[self._tile_sa(s1,a1)]) for a1 in self.actions_in_state(s1)))
+                + (gamma * np.max(self._action_values(s1, self.actions_in_state(s1))))
                 - np.sum(Q[sa_tiled])
             )
 
@@ -408,6 +434,7 @@ class EpsilonGreedyQTiledAgent(QLearningAgent):
 
         self.gamma = data['gamma']
         self.IHT = data['IHT']
+        self._tiled_actions = None
         self.num_tiles = data['num_tiles']
         self.missing_param_value = data['missing_param_value']
 
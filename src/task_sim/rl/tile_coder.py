@@ -30,39 +30,155 @@ from __future__ import print_function, division
 
 basehash = hash
 
+import numpy as np
+
+# coordinates of an IHT are int64 rows; rows narrower than the table are padded with this value
+_PAD = np.iinfo(np.int64).min
+
+def _hash_rows(rows):
+    "FNV-1a style 64 bit hashes of the rows of an int64 matrix"
+    h = np.full(len(rows), 14695981039346656037, dtype=np.uint64)
+    for column in rows.T:
+        h = (h ^ column.view(np.uint64)) * np.uint64(1099511628211)
+    return h ^ (h >> np.uint64(29))
+
 class IHT:
-    "Structure to handle collisions"
+    "Structure to handle collisions, as an open-addressing hash table of integer coordinate rows in numpy arrays"
     def __init__(self, sizeval):
         self.size = sizeval
         self.overfullCount = 0
-        self.dictionary = {}
+        self._clear(0)
+
+    def _clear(self, width):
+        self.n = 0
+        self.coordinates = np.full((16, width), _PAD, dtype=np.int64) # row i holds the coordinates of index i
+        self.slots = np.full(32, -1, dtype=np.int64) # index stored in each slot of the hash table, -1 if empty
 
     def __str__(self):
         "Prepares a string for printing whenever this object is printed"
         return "Collision table:" + \
                " size:" + str(self.size) + \
                " overfullCount:" + str(self.overfullCount) + \
-               " dictionary:" + str(len(self.dictionary)) + " items"
+               " dictionary:" + str(self.n) + " items"
+
+    def __getstate__(self):
+        return {'size': self.size, 'overfullCount': self.overfullCount, 'coordinates': self.coordinates[:self.n]}
+
+    def __setstate__(self, state):
+        self.size = state['size']
+        self.overfullCount = state['overfullCount']
+        if 'dictionary' in state:
+            # pickled by the dict-based IHT: tuples of integer valued coordinates -> index, in insertion order
+            items = sorted(state['dictionary'].items(), key=lambda item: item[1])
+            rows = [obj for obj, index in items]
+        else:
+            rows = state['coordinates']
+        self._clear(0)
+        if len(rows) > 0:
+            self._add(self._rows(rows))
 
     def count (self):
-        return len(self.dictionary)
+        return self.n
 
     def fullp (self):
-        return len(self.dictionary) >= self.size
+        return self.n >= self.size
 
     def getindex (self, obj, readonly=False):
-        d = self.dictionary
-        if obj in d: return d[obj]
-        elif readonly: return None
-        size = self.size
-        count = self.count()
-        if count >= size:
+        index = self.getindices(self._rows([obj]), readonly)[0]
+        return None if index < 0 else int(index)
+
+    def getindices (self, rows, readonly=False):
+        """indices of an int64 matrix of coordinate rows, adding unseen rows in order (-1 for unseen rows if
+        readonly); same results as calling getindex on each row in turn"""
+        rows = self._fit(rows)
+        indices = self._find(rows)
+        missing = np.flatnonzero(indices < 0)
+        if readonly or len(missing) == 0:
+            return indices
+
+        new_rows, first, inverse = np.unique(rows[missing], axis=0, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        new_indices = self.n + rank[inverse.reshape(-1)]
+
+        stored = min(len(order), max(self.size - self.n, 0))
+        self._add(new_rows[order[:stored]])
+        overfull = np.flatnonzero(new_indices >= self.size)
+        if len(overfull) > 0:
             if self.overfullCount==0: print('IHT full, starting to allow collisions')
-            self.overfullCount += 1
-            return basehash(obj) % self.size
+            self.overfullCount += len(overfull)
+            for i in overfull:
+                new_indices[i] = basehash(tuple(rows[missing[i]][rows[missing[i]] != _PAD].tolist())) % self.size
+        indices[missing] = new_indices
+        return indices
+
+    def _rows(self, coordinates):
+        rows = [tuple(row) for row in coordinates]
+        width = max(len(row) for row in rows)
+        return np.array([row + (_PAD,)*(width - len(row)) for row in rows], dtype=np.int64)
+
+    def _fit(self, rows):
+        "pad rows to the width of the table, or widen the table to fit them"
+        rows = np.asarray(rows, dtype=np.int64)
+        width = self.coordinates.shape[1]
+        if rows.shape[1] < width:
+            rows = np.hstack([rows, np.full((len(rows), width - rows.shape[1]), _PAD, dtype=np.int64)])
+        elif rows.shape[1] > width:
+            stored = self.coordinates[:self.n]
+            self._clear(rows.shape[1])
+            if len(stored) > 0:
+                self._add(np.hstack([stored, np.full((len(stored), rows.shape[1] - width), _PAD, dtype=np.int64)]))
+        return rows
+
+    def _find(self, rows):
+        mask = len(self.slots) - 1
+        position = (_hash_rows(rows) & np.uint64(mask)).astype(np.int64)
+        indices = np.full(len(rows), -1, dtype=np.int64)
+        pending = np.arange(len(rows))
+        while len(pending) > 0:
+            slot_indices = self.slots[position[pending]]
+            occupied = slot_indices >= 0
+            found = occupied & (self.coordinates[slot_indices] == rows[pending]).all(axis=1)
+            indices[pending[found]] = slot_indices[found]
+            pending = pending[occupied & ~found]
+            position[pending] = (position[pending] + 1) & mask
+        return indices
+
+    def _add(self, rows):
+        "store new rows (not in the table yet) at the next indices"
+        rows = self._fit(rows)
+        start, end = self.n, self.n + len(rows)
+        if end > len(self.coordinates):
+            capacity = max(end, 2*len(self.coordinates))
+            coordinates = np.full((capacity, rows.shape[1]), _PAD, dtype=np.int64)
+            coordinates[:start] = self.coordinates[:start]
+            self.coordinates = coordinates
+        self.coordinates[start:end] = rows
+        self.n = end
+        if 2*end > len(self.slots):
+            # keep the table at most half full, rehashing every row
+            capacity = len(self.slots)
+            while 2*end > capacity:
+                capacity *= 2
+            self.slots = np.full(capacity, -1, dtype=np.int64)
+            self._insert(np.arange(end))
         else:
-            d[obj] = count
-            return count
+            self._insert(np.arange(start, end))
+
+    def _insert(self, indices):
+        mask = len(self.slots) - 1
+        position = (_hash_rows(self.coordinates[indices]) & np.uint64(mask)).astype(np.int64)
+        pending = np.arange(len(indices))
+        while len(pending) > 0:
+            free = pending[self.slots[position[pending]] < 0]
+            # the first row probing a free slot takes it
+            slots, first = np.unique(position[free], return_index=True)
+            self.slots[slots] = indices[free[first]]
+            claimed = np.zeros(len(indices), dtype=bool)
+            claimed[free[first]] = True
+            pending = pending[~claimed[pending]]
+            position[pending] = (position[pending] + 1) & mask
 
 def hashcoords(coordinates, m, readonly=False):
     if m.__class__.__name__==IHT.__name__: return m.getindex(tuple(coordinates), readonly)
@@ -72,8 +188,25 @@ def hashcoords(coordinates, m, readonly=False):
 from math import floor, log
 from itertools import izip_longest as zip_longest
 
+def _coordinates(numtilings, floats, ints):
+    """int64 array (N x numtilings x coordinates) of the tile coordinates computed by tiles, for an (N x floats)
+    matrix of floats and an (N x ints) matrix of ints"""
+    qfloats = np.floor(np.asarray(floats, dtype=float)*numtilings)
+    tiling = np.arange(numtilings)
+    offsets = tiling[:, None] + 2*tiling[:, None]*np.arange(qfloats.shape[1])[None, :]
+    ints = np.asarray(ints, dtype=np.int64)
+    n = len(qfloats)
+    return np.concatenate([
+        np.broadcast_to(tiling[None, :, None], (n, numtilings, 1)),
+        ((qfloats[:, None, :] + offsets[None, :, :]) // numtilings).astype(np.int64),
+        np.broadcast_to(ints[:, None, :], (n, numtilings, ints.shape[1]))
+    ], axis=2)
+
 def tiles (ihtORsize, numtilings, floats, ints=[], readonly=False):
     """returns num-tilings tile indices corresponding to the floats and ints"""
+    if ihtORsize.__class__.__name__==IHT.__name__:
+        indices = ihtORsize.getindices(_coordinates(numtilings, [floats], [ints])[0], readonly).tolist()
+        return [None if index < 0 else index for index in indices]
     qfloats = [floor(f*numtilings) for f in floats]
     Tiles = []
     for tiling in range(numtilings):
@@ -87,6 +220,21 @@ def tiles (ihtORsize, numtilings, floats, ints=[], readonly=False):
         Tiles.append(hashcoords(coords, ihtORsize, readonly))
     return Tiles
 
+def tiles_batch (ihtORsize, numtilings, floats, ints=None, readonly=False):
+    """returns an (N x num-tilings) array of the tile indices of each row of an (N x floats) matrix of floats and
+    (N x ints) matrix of ints, the same as calling tiles on each row in turn (-1 for tiles missing from a readonly
+    IHT); without an IHT or size, the (N x num-tilings x coordinates) tile coordinates"""
+    floats = np.asarray(floats, dtype=float)
+    if ints is None: ints = np.zeros((len(floats), 0), dtype=np.int64)
+    coords = _coordinates(numtilings, floats, ints)
+    if ihtORsize is None: return coords
+    rows = coords.reshape(-1, coords.shape[2])
+    if ihtORsize.__class__.__name__==IHT.__name__:
+        indices = ihtORsize.getindices(rows, readonly)
+    else:
+        indices = np.array([basehash(tuple(row)) % ihtORsize for row in rows.tolist()], dtype=np.int64)
+    return indices.reshape(len(floats), numtilings)
+
 def tileswrap (ihtORsize, numtilings, floats, wrawidths, ints=[], readonly=False):
     """returns num-tilings tile indices corresponding to the floats and ints, wrapping some floats"""
     qfloats = [floor(f*numtilings) for f in floats]
@@ -276,11 +276,112 @@ high_level_4_sort_relation_list = [
     'lid_closing_box'
 ]
 
-class AMDPState:
+# relation names for each AMDP type, in the order of the state vector (see AMDPState)
+amdp_relation_lists = {
+    0: gripper_drawer_relation_list,
+    1: gripper_drawer_relation_list,
+    2: object_gripper_drawer_relation_list,
+    -1: object_gripper_drawer_relation_list,
+    3: high_level_relation_list,
+    4: high_level_2_object_relation_list,
+    5: high_level_3_object_relation_list,
+    -2: object2_gripper_drawer_relation_list,
+    -3: object3_gripper_drawer_relation_list,
+    6: gripper_box_relation_list,
+    7: gripper_box_relation_list,
+    8: object_gripper_box_relation_list,
+    9: high_level_box_relation_list,
+    10: high_level_sort_relation_list,
+    11: high_level_2_box_relation_list,
+    12: high_level_4_sort_relation_list
+}
+
+# (sorted relation names, relation name -> bit index), shared by every state with the same relation list
+_layouts = {}
+for _amdp_id, _relation_list in amdp_relation_lists.iteritems():
+    _names = tuple(sorted(_relation_list))
+    for _layout in _layouts.itervalues():
+        if _layout[0] == _names:
+            _layouts[_amdp_id] = _layout
+            break
+    else:
+        _layouts[_amdp_id] = (_names, {r: i for i, r in enumerate(_names)})
+_empty_layout = (tuple(), {})
+
+
+class RelationView(object):
+    '''Dictionary-like view of the relations of an AMDPState, read from and written to its packed bits'''
+
+    __slots__ = ('_state',)
+
+    def __init__(self, state):
+        self._state = state
+
+    def __getitem__(self, relation_name):
+        return bool(self._state.code >> self._state._index[relation_name] & 1)
+
+    def __setitem__(self, relation_name, value):
+        bit = 1 << self._state._index[relation_name]
+        if value:
+            self._state.code |= bit
+        else:
+            self._state.code &= ~bit
+
+    def __contains__(self, relation_name):
+        return relation_name in self._state._index
+
+    def __iter__(self):
+        return iter(self._state.relation_names)
+
+    def __len__(self):
+        return len(self._state.relation_names)
+
+    def __eq__(self, other):
+        return dict(self.items()) == (dict(other.items()) if isinstance(other, RelationView) else other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def get(self, relation_name, default=None):
+        if relation_name in self._state._index:
+            return self[relation_name]
+        return default
+
+    def keys(self):
+        return list(self._state.relation_names)
+
+    def values(self):
+        return [bool(b) for b in self._state.to_vector()]
+
+    def items(self):
+        return zip(self._state.relation_names, self.values())
+
+    def iterkeys(self):
+        return iter(self.keys())
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def __str__(self):
+        return str(dict(self.items()))
+
+    def __repr__(self):
+        return str(self)
+
+
+class AMDPState(object):
+
+    __slots__ = ('amdp_id', 'ground_items', 'relation_names', '_index', 'code')
 
     def __init__(self, amdp_id=0, state=None, ground_items=None):
         '''States for amdps at different levels, indicated by type
 
+        The relations are stored as bits of a single int, code, where bit i holds relation_names[i]; relations
+        gives a dict-like view of them.
+
         AMDP Types:
             0 : open drawer
             1 : close drawer
@@ -301,60 +402,34 @@ class AMDPState:
             -2 : flat 2 object 1 drawer
             -3 : flat 3 object 1 drawer
         '''
-        self.relation_names = []
-        self.relations = {}
         self.amdp_id = amdp_id
         self.ground_items = ground_items
-
-        if self.amdp_id == 0 or self.amdp_id == 1:
-            self.relation_names = copy(gripper_drawer_relation_list)
-        elif self.amdp_id == 2 or self.amdp_id == -1:
-            self.relation_names = copy(object_gripper_drawer_relation_list)
-        elif self.amdp_id == 3:
-            self.relation_names = copy(high_level_relation_list)
-        elif self.amdp_id == 4:
-            self.relation_names = copy(high_level_2_object_relation_list)
-        elif self.amdp_id == 5:
-            self.relation_names = copy(high_level_3_object_relation_list)
-        elif self.amdp_id == -2:
-            self.relation_names = copy(object2_gripper_drawer_relation_list)
-        elif self.amdp_id == -3:
-            self.relation_names = copy(object3_gripper_drawer_relation_list)
-        elif self.amdp_id == 6 or self.amdp_id == 7:
-            self.relation_names = copy(gripper_box_relation_list)
-        elif self.amdp_id == 8:
-            self.relation_names = copy(object_gripper_box_relation_list)
-        elif self.amdp_id == 9:
-            self.relation_names = copy(high_level_box_relation_list)
-        elif self.amdp_id == 10:
-            self.relation_names = copy(high_level_sort_relation_list)
-        elif self.amdp_id == 11:
-            self.relation_names = copy(high_level_2_box_relation_list)
-        elif self.amdp_id == 12:
-            self.relation_names = copy(high_level_4_sort_relation_list)
-
-        self.relation_names.sort()
-
-        for relation_name in self.relation_names:
-                self.relations[relation_name] = False
+        self.relation_names, self._index = _layouts.get(amdp_id, _empty_layout)
+        self.code = 0
 
         if state is not None:
             self.project_state(state)
 
+    @property
+    def relations(self):
+        return RelationView(self)
+
     def project_state(self, state):
-        for relation_name in self.relation_names:
+        code = 0
+        for i, relation_name in enumerate(self.relation_names):
             if self.ground_items is not None:
-                for i in range(len(self.ground_items)):
-                    grounded_relation = relation_name.replace(item_map[i], self.ground_items[i])
+                for j in range(len(self.ground_items)):
+                    grounded_relation = relation_name.replace(item_map[j], self.ground_items[j])
             else:
                 grounded_relation = relation_name
             if grounded_relation in state.relations:
-                self.relations[relation_name] = True
+                code |= 1 << i
+        self.code = code
 
-        if 'gripper_holding_drawer' in self.relation_names and state.grippers['gripper'].holding == 'drawer':
+        if 'gripper_holding_drawer' in self._index and state.grippers['gripper'].holding == 'drawer':
             self.relations['gripper_holding_drawer'] = True
 
-        if 'gripper_holding_lid' in self.relation_names and state.grippers['gripper'].holding == 'lid':
+        if 'gripper_holding_lid' in self._index and state.grippers['gripper'].holding == 'lid':
             self.relations['gripper_holding_lid'] = True
 
         if (self.amdp_id <= 2) or (self.amdp_id >= 6 and self.amdp_id <= 8):
@@ -363,32 +438,69 @@ class AMDPState:
             else:
                 item = 'apple'
 
-            if 'gripper_holding_apple' in self.relation_names and state.grippers['gripper'].holding == item:
+            if 'gripper_holding_apple' in self._index and state.grippers['gripper'].holding == item:
                 self.relations['gripper_holding_apple'] = True
 
         if self.amdp_id <= -2:
-            if 'gripper_holding_banana' in self.relation_names and state.grippers['gripper'].holding == 'banana':
+            if 'gripper_holding_banana' in self._index and state.grippers['gripper'].holding == 'banana':
                 self.relations['gripper_holding_banana'] = True
-            if 'gripper_holding_carrot' in self.relation_names and state.grippers['gripper'].holding == 'carrot':
+            if 'gripper_holding_carrot' in self._index and state.grippers['gripper'].holding == 'carrot':
                 self.relations['gripper_holding_carrot'] = True
 
-        if 'gripper_open' in self.relation_names:
+        if 'gripper_open' in self._index:
             self.relations['gripper_open'] = not state.grippers['gripper'].closed
 
     def to_vector(self):
-        v = []
-        for r in self.relation_names:
-            v.append(int(self.relations[r]))
-        return v
+        code = self.code
+        return [(code >> i) & 1 for i in range(len(self.relation_names))]
+
+    def from_code(self, code):
+        '''Returns a new state of the same type with the given packed relations'''
+        s = copy(self)
+        s.code = code
+        return s
 
     def from_vector(self, v):
-        for i,r in enumerate(self.relation_names):
-            self.relations[r] = bool(v[i])
-        return deepcopy(self)
+        code = 0
+        for i in range(len(self.relation_names)):
+            if v[i]:
+                code |= 1 << i
+        return self.from_code(code)
+
+    def __copy__(self):
+        s = AMDPState.__new__(AMDPState)
+        s.amdp_id = self.amdp_id
+        s.ground_items = self.ground_items
+        s.relation_names = self.relation_names
+        s._index = self._index
+        s.code = self.code
+        return s
+
+    def __deepcopy__(self, memo):
+        s = copy(self)
+        s.ground_items = deepcopy(self.ground_items, memo)
+        return s
+
+    def __getstate__(self):
+        # same layout as the attribute dictionary of the original dict-based states, so older pickles still load
+        return {
+            'amdp_id': self.amdp_id,
+            'ground_items': self.ground_items,
+            'relation_names': list(self.relation_names),
+            'relations': dict(self.relations.items())
+        }
+
+    def __setstate__(self, state):
+        self.amdp_id = state['amdp_id']
+        self.ground_items = state.get('ground_items')
+        self.relation_names, self._index = _layouts.get(self.amdp_id, _empty_layout)
+        self.code = 0
+        for relation_name, value in state['relations'].iteritems():
+            self.relations[relation_name] = value
 
     def __str__(self):
         s = ''
-        for key in self.relations:
+        for key in self.relation_names:
             s += str(key)
             s += str(self.relations[key])
             s += '\n'
@@ -398,9 +510,14 @@ class AMDPState:
         return str(self)
 
     def __hash__(self):
-        return hash(frozenset(self.relations.items()))
+        return hash(self.code)
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            return self.relations == other.relations
+            return self.code == other.code and (
+                self.relation_names is other.relation_names or self.relation_names == other.relation_names
+            )
         return False
+
+    def __ne__(self, other):
+        return not self == other
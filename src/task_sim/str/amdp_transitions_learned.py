@@ -1,10 +1,13 @@
 #!/usr/bin/env python
 
-from copy import deepcopy
+from copy import copy
 import ast
+import atexit
 import pickle
+import threading
 import h5py
 import numpy as np
+from scipy import sparse
 from shutil import copyfile
 
 from task_sim.str.amdp_state import AMDPState
@@ -13,8 +16,22 @@ from task_sim.str.stochastic_state_action import StochasticState
 
 class AMDPTransitionsLearned:
 
-    def __init__(self, amdp_id=0, filename=None, reinit=True):
+    abstract_amdps = [3, 4, 5, 9, 10, 11, 12]
+
+    def __init__(self, amdp_id=0, filename=None, reinit=True, write_behind=False, flush_interval=0):
+        '''Transition function for an AMDP, learned from counts stored in an HDF5 file
+
+        Args:
+            amdp_id: AMDP type, see AMDPState
+            filename: HDF5 file holding the transition counts (None for the hand-coded abstract AMDPs)
+            reinit: overwrite the file if True, otherwise continue from the counts already in it
+            write_behind: keep counts in memory and only write them to the HDF5 file in bulk, on save(), every
+                flush_interval updates, and at shutdown
+            flush_interval: number of updates between checkpoints in write_behind mode (0 to only flush on save())
+        '''
         self.amdp_id = amdp_id
+        self.write_behind = write_behind and filename is not None
+        self.flush_interval = flush_interval
 
         # If there is an HDF5 file to save, then populate this function with the
         # learners' code
@@ -33,29 +50,156 @@ class AMDPTransitionsLearned:
             self._state_idx = lambda s: str(s.to_vector())
             self._action_idx = lambda a: str([a.action_type, a.object])
             self._state_template = AMDPState(self.amdp_id)
+            self._lock = threading.Lock()
+
+            # (state code, action type, action object) -> [(p, s')], as returned by transition_function
+            self._successor_cache = {}
+            self.cache_hits = 0
+            self.cache_misses = 0
+
+            # listener -> codes of the states whose transitions were updated since the listener last collected them
+            self._update_listeners = {}
+
+        if self.write_behind:
+            # (state code, action key) -> {successor state code: count}
+            self._counts = {}
+            self._dirty = set()
+            self._updates_since_flush = 0
+            self._load_counts()
+            atexit.register(self.close)
+
+    def _code_vector(self, code):
+        return self._state_template.from_code(code).to_vector()
+
+    def _load_counts(self):
+        '''Read the counts of an existing HDF5 file into the in-memory table'''
+        for state_s, transitions in self.transition.iteritems():
+            s_code = self._state_template.from_vector(ast.literal_eval(state_s)).code
+            for action_s, results in transitions.iteritems():
+                self._counts[(s_code, action_s)] = {
+                    self._state_template.from_vector(ast.literal_eval(s_prime_s)).code: freq[0]
+                    for s_prime_s, freq in results.iteritems()
+                }
 
+    def _flush(self):
+        '''Write all counts modified since the last flush to the HDF5 file. Caller must hold the lock.'''
+        for key in self._dirty:
+            s_code, action_s = key
+            sa_group = "{}/{}".format(str(self._code_vector(s_code)), action_s)
+            if sa_group in self.transition:
+                sa = self.transition[sa_group]
+            else:
+                sa = self.transition.create_group(sa_group)
+
+            successors = self._counts[key]
+            for s_prime_code, count in successors.iteritems():
+                s_prime_key = str(self._code_vector(s_prime_code))
+                if s_prime_key in sa:
+                    sa[s_prime_key][0] = count
+                else:
+                    sa.create_dataset(s_prime_key, data=[count])
+            sa.attrs["total"] = float(sum(successors.values()))
+
+        self._dirty.clear()
+        self._updates_since_flush = 0
+        self.transition.flush()
 
     def update_transition(self, s, a, s_prime):
-        # Update the new transition function
-        sa_group = "{}/{}".format(self._state_idx(s), self._action_idx(a))
-        s_prime_key = self._state_idx(s_prime)
+        with self._lock:
+            self._successor_cache.pop((s.code, a.action_type, a.object), None)
+            for updated in self._update_listeners.itervalues():
+                updated.add(s.code)
 
-        if sa_group in self.transition:
-            sa = self.transition[sa_group]
-        else:
-            sa = self.transition.create_group(sa_group)
-            sa.attrs["total"] = 0.
+            if self.write_behind:
+                key = (s.code, self._action_idx(a))
+                successors = self._counts.setdefault(key, {})
+                successors[s_prime.code] = successors.get(s_prime.code, 0.) + 1
+                self._dirty.add(key)
+                self._updates_since_flush += 1
+                if 0 < self.flush_interval <= self._updates_since_flush:
+                    self._flush()
+                return
 
-        if s_prime_key in sa:
-            sas = sa[s_prime_key]
-        else:
-            sas = sa.create_dataset(s_prime_key, data=[0.])
+            # Update the new transition function
+            sa_group = "{}/{}".format(self._state_idx(s), self._action_idx(a))
+            s_prime_key = self._state_idx(s_prime)
+
+            if sa_group in self.transition:
+                sa = self.transition[sa_group]
+            else:
+                sa = self.transition.create_group(sa_group)
+                sa.attrs["total"] = 0.
+
+            if s_prime_key in sa:
+                sas = sa[s_prime_key]
+            else:
+                sas = sa.create_dataset(s_prime_key, data=[0.])
+
+            # Update the dataset and the attr
+            sas[0] += 1
+            sa.attrs["total"] += 1
+
+    def merge_counts(self, counts):
+        '''Add transition counts recorded elsewhere (see TransitionCounts), with the same effect as the matching calls
+        to update_transition'''
+        with self._lock:
+            for (s_code, action_type, action_object), successors in counts.iteritems():
+                self._successor_cache.pop((s_code, action_type, action_object), None)
+                for updated in self._update_listeners.itervalues():
+                    updated.add(s_code)
+                action_s = str([action_type, action_object])
+
+                if self.write_behind:
+                    key = (s_code, action_s)
+                    stored = self._counts.setdefault(key, {})
+                    for s_prime_code, count in successors.iteritems():
+                        stored[s_prime_code] = stored.get(s_prime_code, 0.) + count
+                    self._dirty.add(key)
+                    self._updates_since_flush += sum(successors.values())
+                    continue
+
+                sa_group = "{}/{}".format(str(self._code_vector(s_code)), action_s)
+                if sa_group in self.transition:
+                    sa = self.transition[sa_group]
+                else:
+                    sa = self.transition.create_group(sa_group)
+                    sa.attrs["total"] = 0.
+                for s_prime_code, count in successors.iteritems():
+                    s_prime_key = str(self._code_vector(s_prime_code))
+                    if s_prime_key in sa:
+                        sa[s_prime_key][0] += count
+                    else:
+                        sa.create_dataset(s_prime_key, data=[float(count)])
+                    sa.attrs["total"] += count
 
-        # Update the dataset and the attr
-        sas[0] += 1
-        sa.attrs["total"] += 1
+            if self.write_behind and 0 < self.flush_interval <= self._updates_since_flush:
+                self._flush()
+
+    def track_updates(self, listener):
+        '''Start (or restart) recording which states have their transitions updated, for collection by listener'''
+        with self._lock:
+            self._update_listeners[listener] = set()
+
+    def pop_updated_states(self, listener):
+        '''Returns the states updated since listener last called this (or track_updates), and clears them'''
+        with self._lock:
+            codes = self._update_listeners[listener]
+            self._update_listeners[listener] = set()
+        return [self._state_template.from_code(code) for code in codes]
+
+    def clear_cache(self):
+        with self._lock:
+            self._successor_cache = {}
 
     def get_states(self):
+        if self.write_behind:
+            with self._lock:
+                codes = set()
+                for (s_code, action_s), successors in self._counts.iteritems():
+                    codes.add(s_code)
+                    codes.update(successors)
+            return [self._state_template.from_code(code) for code in codes]
+
         s = set()
         for state_s, transitions in self.transition.iteritems():
             state_v = ast.literal_eval(state_s)
@@ -71,7 +215,7 @@ class AMDPTransitionsLearned:
     def transition_function(self, s, a):
         if self.amdp_id == 3:
             # hand-coded abstract transitions
-            s_prime = deepcopy(s)
+            s_prime = copy(s)
             if s.relations['apple_inside_drawer'] and s.relations['drawer_closing_stack']:
                 if a.action_type == 0:
                     # open drawer
@@ -115,7 +259,7 @@ class AMDPTransitionsLearned:
             return [(1.0, s_prime)]
         elif self.amdp_id == 4:
             # hand-coded abstract transitions
-            s_prime = deepcopy(s)
+            s_prime = copy(s)
             if a.action_type == 0:
                 # open drawer
                 s_prime.relations['drawer_closing_stack'] = False
@@ -130,7 +274,7 @@ class AMDPTransitionsLearned:
             return [(1.0, s_prime)]
         elif self.amdp_id == 5:
             # hand-coded abstract transitions
-            s_prime = deepcopy(s)
+            s_prime = copy(s)
             if a.action_type == 0:
                 # open drawer
                 s_prime.relations['drawer_closing_stack'] = False
@@ -147,7 +291,7 @@ class AMDPTransitionsLearned:
             return [(1.0, s_prime)]
         elif self.amdp_id == 9:
             # hand-coded abstract transitions
-            s_prime = deepcopy(s)
+            s_prime = copy(s)
             if a.action_type == 6:
                 # open box
                 s_prime.relations['lid_closing_box'] = False
@@ -161,7 +305,7 @@ class AMDPTransitionsLearned:
             return [(1.0, s_prime)]
         elif self.amdp_id == 10:
             # hand-coded abstract transitions
-            s_prime = deepcopy(s)
+            s_prime = copy(s)
             if a.action_type == 4:
                 s_prime.relations['apple_inside_drawer'] = True
                 s_prime.relations['banana_inside_drawer'] = True
@@ -172,7 +316,7 @@ class AMDPTransitionsLearned:
             return [(1.0, s_prime)]
         elif self.amdp_id == 11:
             # hand-coded abstract transitions
-            s_prime = deepcopy(s)
+            s_prime = copy(s)
             if a.action_type == 6:
                 # open box
                 s_prime.relations['lid_closing_box'] = False
@@ -188,7 +332,7 @@ class AMDPTransitionsLearned:
             return [(1.0, s_prime)]
         elif self.amdp_id == 12:
             # hand-coded abstract transitions
-            s_prime = deepcopy(s)
+            s_prime = copy(s)
             if a.action_type == 4:
                 s_prime.relations['apple_inside_drawer'] = True
                 s_prime.relations['banana_inside_drawer'] = True
@@ -201,23 +345,127 @@ class AMDPTransitionsLearned:
 
         # Otherwise, use the transition function that we're learning
         else:
-            sa_group = "{}/{}".format(self._state_idx(s), self._action_idx(a))
-            if sa_group in self.transition:
-                next_states = []
-                total = self.transition[sa_group].attrs["total"]
-                for s_prime_s, freq in self.transition[sa_group].iteritems():
-                    s_prime_v = ast.literal_eval(s_prime_s)
-                    s_prime = self._state_template.from_vector(s_prime_v)
-                    next_states.append((freq[0]/total, s_prime,))
+            # successor lists are shared between callers, and must not be modified
+            key = (s.code, a.action_type, a.object)
+            with self._lock:
+                next_states = self._successor_cache.get(key)
+                if next_states is not None:
+                    self.cache_hits += 1
+                    return next_states
 
-                return next_states
-            else:
-                return [(1.0, s)]
+                self.cache_misses += 1
+                next_states = self._learned_successors(s, a)
+                self._successor_cache[key] = next_states
+            return next_states
+
+    def _learned_successors(self, s, a):
+        '''Successor distribution of (s, a) from the learned counts. Caller must hold the lock.'''
+        if self.write_behind:
+            successors = self._counts.get((s.code, self._action_idx(a)))
+            if successors is None:
+                return [(1.0, copy(s))]
+            total = sum(successors.values())
+            return [(count/total, self._state_template.from_code(s_prime_code))
+                    for s_prime_code, count in successors.iteritems()]
+
+        sa_group = "{}/{}".format(self._state_idx(s), self._action_idx(a))
+        if sa_group in self.transition:
+            next_states = []
+            total = self.transition[sa_group].attrs["total"]
+            for s_prime_s, freq in self.transition[sa_group].iteritems():
+                s_prime_v = ast.literal_eval(s_prime_s)
+                s_prime = self._state_template.from_vector(s_prime_v)
+                next_states.append((freq[0]/total, s_prime,))
+
+            return next_states
+        else:
+            return [(1.0, copy(s))]
+
+    def transition_matrices(self, states, actions):
+        '''Compile the transition function into one sparse (S x S') matrix per action
+
+        Args:
+            states: list of AMDPStates; a state's position in the list is its integer id
+            actions: list of Actions; a matrix is returned for each, in the same order
+
+        Returns:
+            list of scipy.sparse.csr_matrix, where row i of matrix k is the successor distribution of
+            (states[i], actions[k])
+        '''
+        n = len(states)
+        rows = [[] for _ in actions]
+        cols = [[] for _ in actions]
+        data = [[] for _ in actions]
+        covered = [np.zeros(n, dtype=bool) for _ in actions]
+
+        if self.write_behind:
+            state_ids = {s.code: i for i, s in enumerate(states)}
+            action_ids = {self._action_idx(a): k for k, a in enumerate(actions)}
+            with self._lock:
+                for (s_code, action_s), successors in self._counts.iteritems():
+                    if s_code not in state_ids or action_s not in action_ids:
+                        continue
+                    i = state_ids[s_code]
+                    k = action_ids[action_s]
+                    total = sum(successors.values())
+                    for s_prime_code, count in successors.iteritems():
+                        rows[k].append(i)
+                        cols[k].append(state_ids[s_prime_code])
+                        data[k].append(count/total)
+                    covered[k][i] = True
+        elif self.amdp_id not in self.abstract_amdps:
+            # read the counts straight out of the HDF5 file, matching keys as strings
+            state_ids = {self._state_idx(s): i for i, s in enumerate(states)}
+            action_ids = {self._action_idx(a): k for k, a in enumerate(actions)}
+            for state_s, transitions in self.transition.iteritems():
+                if state_s not in state_ids:
+                    continue
+                i = state_ids[state_s]
+                for action_s, results in transitions.iteritems():
+                    if action_s not in action_ids:
+                        continue
+                    k = action_ids[action_s]
+                    total = results.attrs["total"]
+                    for s_prime_s, freq in results.iteritems():
+                        rows[k].append(i)
+                        cols[k].append(state_ids[s_prime_s])
+                        data[k].append(freq[0]/total)
+                    covered[k][i] = True
+        else:
+            # hand-coded transitions, evaluate each (s, a) once
+            state_ids = {s: i for i, s in enumerate(states)}
+            for i, s in enumerate(states):
+                for k, a in enumerate(actions):
+                    for p, s_prime in self.transition_function(s, a):
+                        rows[k].append(i)
+                        cols[k].append(state_ids[s_prime])
+                        data[k].append(p)
+                    covered[k][i] = True
+
+        matrices = []
+        for k in range(len(actions)):
+            # unobserved state-action pairs stay in place, matching transition_function
+            missing = np.flatnonzero(~covered[k])
+            rows[k].extend(missing)
+            cols[k].extend(missing)
+            data[k].extend([1.0]*len(missing))
+            matrices.append(sparse.csr_matrix((data[k], (rows[k], cols[k])), shape=(n, n)))
+
+        return matrices
 
 
     def save(self, suffix=''):
+        if self.write_behind:
+            with self._lock:
+                self._flush()
         self.transition.flush()
 
+    def close(self):
+        '''Write any outstanding counts and close the HDF5 file'''
+        if self.transition:
+            self.save()
+            self.transition.close()
+
     def save_copy(self, suffix='_best'):
         self.save()
         name = self.filename.replace('.hdf5', '')
@@ -227,5 +475,24 @@ class AMDPTransitionsLearned:
         # self.transition.copy()
 
 
+class TransitionCounts:
+
+    def __init__(self):
+        '''Transition counts recorded apart from an AMDPTransitionsLearned (e.g. by a learner in a worker process), to
+        be merged into it with merge_counts. Stands in for the transition function of a LearnTransitionFunction.'''
+        # (state code, action type, action object) -> {successor state code: count}
+        self.counts = {}
+
+    def update_transition(self, s, a, s_prime):
+        successors = self.counts.setdefault((s.code, a.action_type, a.object), {})
+        successors[s_prime.code] = successors.get(s_prime.code, 0) + 1
+
+    def pop_counts(self):
+        '''Returns the counts recorded since the last call, and clears them'''
+        counts = self.counts
+        self.counts = {}
+        return counts
+
+
 if __name__ == '__main__':
     pass
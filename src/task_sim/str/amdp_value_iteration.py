@@ -2,7 +2,14 @@
 
 from copy import deepcopy
 import datetime
+import hashlib
+import heapq
+import itertools
+import os
 import pickle
+import tempfile
+from zipfile import BadZipfile
+import numpy as np
 
 from task_sim.msg import Action
 
@@ -23,11 +30,19 @@ class AMDPValueIteration:
 
     abstract_amdps = [3, 4, 5, 9, 10, 11, 12]
 
+    # discount, and the error bound that terminates value iteration
+    gamma = 0.8
+    epsilon = 1
+
     def __init__(self, amdp_id, transition_function):
         self.U = {}
         self.actions = []
         self.amdp_id = amdp_id
 
+        # incremental solver bookkeeping, see solve_incremental
+        self._residuals = None
+        self._predecessors = {}
+
         self.initialize(transition_function)
 
     def initialize(self, transition_function):
@@ -200,9 +215,10 @@ class AMDPValueIteration:
 
     def init_utilities(self, debug=0):
         self.U = {}
+        self._residuals = None
         if self.amdp_id in self.abstract_amdps:
-            s = AMDPState(amdp_id=self.amdp_id)
-            self.enumerate_relations(s)
+            for s in self.enumerate_states():
+                self.U[s] = 0.0
         else:
             if debug > 0:
                 print 'Initializing utilities over all states in the state list...'
@@ -215,31 +231,88 @@ class AMDPValueIteration:
     def init_updated_utilities(self):
         if self.amdp_id not in self.abstract_amdps:
             states = self.T.get_states()
-            for s in states:
-                if s not in self.U:
-                    self.U[deepcopy(s)] = 0.0
         else:
-            # probably not the best way to handle this, but shouldn't matter as these utilities should have been loaded
-            # from a file instead of solved for at runtime...
-            s = AMDPState(amdp_id=self.amdp_id)
-            self.enumerate_relations(s)
-
-    def enumerate_relations(self, s, i=0):
-        '''recursively set all attributes in an amdp state to cover all possible state assignments, store them in U'''
-        if i == len(s.relations.keys()) - 1:
-            s.relations[s.relations.keys()[i]] = True
-            self.U[deepcopy(s)] = 0.0
-            s.relations[s.relations.keys()[i]] = False
-            self.U[deepcopy(s)] = 0.0
+            states = self.enumerate_states()
+        for s in states:
+            if s not in self.U:
+                self.U[deepcopy(s)] = 0.0
+
+    def enumerate_states(self):
+        '''every possible relation assignment of an amdp state, as a list of states'''
+        s = AMDPState(amdp_id=self.amdp_id)
+        return [s.from_code(code) for code in range(2**len(s.relation_names))]
+
+    def load_abstract_utilities(self, cache_dir=None, debug=0):
+        '''Set U to the solved utilities of an abstract amdp, solving only if no cached solution exists
+
+        The hand-coded model is compiled into a dense transition table over every state, and solutions are cached
+        under a hash of that table, the rewards and the solver constants, so a change to the model is picked up
+        automatically. If the cache can't be read or written, the utilities are solved in memory.
+
+        Args:
+            cache_dir: directory of the cached solutions, defaults to value_tables/ next to this file
+        '''
+        assert self.amdp_id in self.abstract_amdps, "Not an abstract AMDP: {}".format(self.amdp_id)
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'value_tables')
+
+        states = self.enumerate_states()
+        P = self.T.transition_matrices(states, self.actions)
+        R = np.array([reward(s, amdp_id=self.amdp_id) for s in states], dtype=float)
+        terminal = np.array([is_terminal(s, amdp_id=self.amdp_id) for s in states], dtype=bool)
+
+        model_hash = hashlib.sha1()
+        for P_a in P:
+            model_hash.update(P_a.toarray().tobytes())
+        model_hash.update(R.tobytes())
+        model_hash.update(terminal.tobytes())
+        model_hash.update(repr((self.gamma, self.epsilon)))
+        filename = os.path.join(cache_dir, 'U{}_{}.npz'.format(self.amdp_id, model_hash.hexdigest()[:16]))
+
+        U = None
+        if os.path.exists(filename):
+            try:
+                with np.load(filename) as data:
+                    U = data['U']
+                if len(U) != len(states):
+                    U = None
+            except (BadZipfile, IOError, KeyError, ValueError):
+                U = None
+            if U is None:
+                print 'Could not read utilities from ' + filename + ', solving again'
+            elif debug > 0:
+                print 'Loaded utilities from ' + filename
+
+        if U is None:
+            U = self._solve_matrices(P, R, terminal, np.zeros(len(states)), debug=debug)
+            try:
+                if not os.path.isdir(cache_dir):
+                    os.makedirs(cache_dir)
+                # write to a temporary file and rename it, so readers never see a partial file
+                fd, tmp_filename = tempfile.mkstemp(suffix='.npz', dir=cache_dir)
+                os.close(fd)
+                try:
+                    np.savez(tmp_filename, U=U)
+                    os.rename(tmp_filename, filename)
+                except:
+                    os.remove(tmp_filename)
+                    raise
+                if debug > 0:
+                    print 'Saved utilities to ' + filename
+            except (IOError, OSError) as e:
+                print 'Could not save utilities to ' + filename + ': ' + str(e)
+
+        self.U = dict(zip(states, U.tolist()))
+        self._residuals = None
+
+    def solve(self, debug=0, compiled=False):
+        self._residuals = None
+        if compiled:
+            self.solve_compiled(debug=debug)
             return
-        s.relations[s.relations.keys()[i]] = True
-        self.enumerate_relations(s, i + 1)
-        s.relations[s.relations.keys()[i]] = False
-        self.enumerate_relations(s, i + 1)
-
-    def solve(self, debug=0):
-        gamma = 0.8
-        epsilon = 1
+
+        gamma = self.gamma
+        epsilon = self.epsilon
         n = 0
         # termination_check = False
         start_time = datetime.datetime.now()
@@ -304,6 +377,148 @@ class AMDPValueIteration:
         # print 'Finished. Saving...'
         # self.save()
 
+    def solve_compiled(self, debug=0):
+        '''Value iteration over an integer-indexed copy of the state space, with the Bellman backup computed as
+        sparse matrix-vector products. Produces the same utilities as solve().'''
+        start_time = datetime.datetime.now()
+
+        states = self.U.keys()
+        P = self.T.transition_matrices(states, self.actions)
+        if debug > 0:
+            print 'Compiled transitions for ' + str(len(states)) + ' states in ' + \
+                  str(datetime.datetime.now() - start_time)
+
+        R = np.array([reward(s, amdp_id=self.amdp_id) for s in states], dtype=float)
+        terminal = np.array([is_terminal(s, amdp_id=self.amdp_id) for s in states], dtype=bool)
+        U = np.array([self.U[s] for s in states], dtype=float)
+
+        U = self._solve_matrices(P, R, terminal, U, debug=debug)
+
+        self.U = dict(zip(states, U.tolist()))
+        self._residuals = None
+
+        if debug > 0:
+            print 'Total elapsed time: ' + str(datetime.datetime.now() - start_time)
+
+    def _solve_matrices(self, P, R, terminal, U, debug=0):
+        '''Value iteration on compiled transitions (one matrix per action), rewards and terminal flags, starting
+        from the utility vector U'''
+        gamma = self.gamma
+        epsilon = self.epsilon
+        n = 0
+        start_time = datetime.datetime.now()
+
+        while True:
+            n += 1
+            if debug > 0:
+                print 'Iteration ' + str(n)
+
+            max_u = np.max([P_a.dot(U) for P_a in P], axis=0)
+            U_prime = np.where(terminal, R, R + gamma*max_u)
+            delta = np.max(np.abs(U - U_prime)) if len(U) > 0 else 0.0
+            U = U_prime
+
+            if delta < epsilon*(1 - gamma)/gamma:
+                break
+
+            if debug > 0:
+                print 'Delta: ' + str(delta) + ', continuing...'
+                print 'Elapsed time: ' + str(datetime.datetime.now() - start_time)
+
+        return U
+
+    def solve_incremental(self, updated_states=None, debug=0):
+        '''Prioritized sweeping from the previous solution: Gauss-Seidel backups of the states whose transitions
+        changed since the last call and, while their utilities keep moving, of their predecessors.
+
+        An upper bound on each state's Bellman residual is carried between calls, and a state is backed up whenever
+        its bound reaches the threshold that terminates solve(), epsilon*(1 - gamma)/gamma. Every residual ends below
+        that threshold, so the utilities are within epsilon/gamma of the optimum, a factor 1/gamma looser than the
+        epsilon bound of solve(). The first call backs up every state.
+
+        New states must already be in U (see init_updated_utilities).
+
+        Args:
+            updated_states: states whose transitions changed; if None, they are collected from the transition
+                function
+        '''
+        gamma = self.gamma
+        epsilon = self.epsilon
+        threshold = epsilon*(1 - gamma)/gamma
+        start_time = datetime.datetime.now()
+        learned = self.amdp_id not in self.abstract_amdps
+
+        if self._residuals is None:
+            self._residuals = {}
+            self._predecessors = {}
+            if learned:
+                self.T.track_updates(self)
+            updated_states = self.U.keys()
+        elif updated_states is None:
+            updated_states = self.T.pop_updated_states(self) if learned else []
+
+        # states with unknown residuals: changed transitions, and states added since the last solve
+        seeds = set(updated_states)
+        seeds.update(s for s in self.U if s not in self._residuals)
+
+        counter = itertools.count()
+        queue = []
+        for s in seeds:
+            self._index_successors(s)
+            self._residuals[s] = float('inf')
+            queue.append((-self._residuals[s], next(counter), s))
+        heapq.heapify(queue)
+
+        n = 0
+        while queue:
+            priority, _, s = heapq.heappop(queue)
+            if -priority != self._residuals[s]:
+                # superseded by a later entry, or already backed up
+                continue
+
+            n += 1
+            u = self._backup(s, gamma)
+            d = abs(self.U[s] - u)
+            self.U[s] = u
+            self._residuals[s] = 0.0
+            if d == 0:
+                continue
+
+            for p in self._predecessors.get(s, ()):
+                r = self._residuals[p] + gamma*d
+                self._residuals[p] = r
+                if r >= threshold:
+                    heapq.heappush(queue, (-r, next(counter), p))
+
+        if debug > 0:
+            print 'Backed up ' + str(n) + ' states from ' + str(len(seeds)) + ' updated states in ' + \
+                  str(datetime.datetime.now() - start_time)
+
+    def _index_successors(self, s):
+        '''Record s as a predecessor of each of its successors'''
+        if is_terminal(s, amdp_id=self.amdp_id):
+            return
+        for a in self.actions:
+            for p, s_prime in self.T.transition_function(s, a):
+                if s_prime in self._predecessors:
+                    self._predecessors[s_prime].add(s)
+                else:
+                    self._predecessors[s_prime] = set([s])
+
+    def _backup(self, s, gamma):
+        if is_terminal(s, amdp_id=self.amdp_id):
+            return reward(s, amdp_id=self.amdp_id)
+
+        max_u = -999999
+        for a in self.actions:
+            current_u = 0.0
+            for p, s_prime in self.T.transition_function(s, a):
+                current_u += p*self.U[s_prime]
+            if current_u > max_u:
+                max_u = current_u
+
+        return reward(s, amdp_id=self.amdp_id) + gamma*max_u
+
     def save(self, suffix=''):
         pickle.dump(self.U, file('U' + str(self.amdp_id) + str(suffix) + '.pkl', mode='w'))
         print 'Utilities saved.'
@@ -7,6 +7,10 @@ import os
 import sys
 import glob
 import copy
+import hashlib
+import inspect
+import tempfile
+from zipfile import BadZipfile
 import numpy as np
 from sklearn.externals import joblib
 
@@ -16,11 +20,27 @@ from geometry_msgs.msg import Point
 
 from task_sim.msg import Action
 from task_sim import data_utils as DataUtils
+from task_sim.oomdp import oo_state, oomdp_classes
 from task_sim.oomdp.oo_state import OOState
+from task_sim.str import amdp_state
 from task_sim.str.amdp_state import AMDPState
 from task_sim.str.stochastic_state_action import StochasticAction
 from amdp_plan_network import AMDPPlanNetwork
 
+# version of the demonstration caches written by DemonstrationMode
+DEMO_CACHE_FORMAT = 1
+
+
+def demo_cache_version():
+    """Hash of the code that derives state-action pairs from demonstrations,
+    stored with a cache to detect stale files"""
+    code_hash = hashlib.sha1()
+    for module in (sys.modules[__name__], DataUtils, oo_state, oomdp_classes, amdp_state):
+        code_hash.update(inspect.getsource(module))
+    code_hash.update(str(DEMO_CACHE_FORMAT))
+    return code_hash.hexdigest()
+
+
 class DemonstrationMode(object):
     """Enum definitions of the demo modes"""
     RANDOM = 1
@@ -83,69 +103,8 @@ class DemonstrationMode(object):
             print("Found", len(demo_list), 'demonstrations for container', container_env)
             demos_list.extend(demo_list)
 
-            sa_pairs = []
-            prev_state_msg = None
-            for demo_file in demos_list:
-                print("Reading", demo_file, "...")
-                bag = rosbag.Bag(demo_file)
-                for topic, msg, t in bag.read_messages(topics=['/table_sim/task_log']):
-                    if prev_state_msg is None:
-                        prev_state_msg = copy.deepcopy(msg.state)
-
-                    elif msg.action.action_type != Action.NOOP:
-                        pair = (copy.deepcopy(prev_state_msg), copy.deepcopy(msg.action))
-                        sa_pairs.append(pair)
-                        prev_state_msg = copy.deepcopy(msg.state)
-                bag.close()
-
             pi = {}
-            for pair in sa_pairs:
-                state_msg = pair[0]
-                s = AMDPState(amdp_id=amdp_id, state=OOState(state=state_msg))
-                a = pair[1]
-
-                # convert action into something that fits into the new action list
-                if a.action_type == Action.PLACE:
-                    a.object = DataUtils.get_task_frame(state_msg, a.position)
-                    a.position = Point()
-                elif a.action_type == Action.MOVE_ARM:
-                    a.object = DataUtils.get_task_frame(state_msg, a.position)
-                    if a.object != 'stack' and a.object != 'drawer' and a.object != 'box' and a.object != 'lid':
-                        for o in state_msg.objects:
-                            if o.name != 'apple' or o.name != 'banana' or o.name != 'carrot':
-                                continue
-                            if a.position == o.position:
-                                a.object = o.name
-                                break
-
-                        if a.object != 'apple' or a.object != 'banana' or a.object != 'carrot':
-                            x = state_msg.gripper_position.x
-                            y = state_msg.gripper_position.y
-                            px = a.position.x
-                            py = a.position.y
-                            if px == x and py > y:
-                                a.object = 'b'
-                            elif px < x and py > y:
-                                a.object = 'bl'
-                            elif px < x and py == y:
-                                a.object = 'l'
-                            elif px < x and py < y:
-                                a.object = 'fl'
-                            elif px == x and py < y:
-                                a.object = 'f'
-                            elif px > x and py < y:
-                                a.object = 'fr'
-                            elif px > x and py == y:
-                                a.object = 'r'
-                            else:
-                                a.object = 'br'
-                    a.position = Point()
-                elif a.action_type == Action.GRASP:
-                    a.position = Point()
-                else:
-                    a.position = Point()
-                    a.object = ''
-
+            for s, a in self._demo_pairs(container_env, amdp_id, demos_list):
                 # update the policy
                 if s in pi:
                     pi[s].update(a)
@@ -213,3 +172,132 @@ class DemonstrationMode(object):
 
         # All configs are loaded. Return them
         return demo_config
+
+    def _demo_pairs(self, container_env, amdp_id, demos_list):
+        """Returns the (AMDPState, Action) pairs of the demonstrations, read
+        from a cache next to the bags unless the bags or the code deriving the
+        pairs have changed since it was written"""
+        cache_file = os.path.join(
+            rospkg.RosPack().get_path('task_sim'),
+            'data',
+            container_env,
+            'demos',
+            'demo_pairs_{}.npz'.format(amdp_id)
+        )
+        mtimes = [os.path.getmtime(demo_file) for demo_file in demos_list]
+        state_template = AMDPState(amdp_id=amdp_id)
+
+        if os.path.exists(cache_file):
+            try:
+                with np.load(cache_file) as npz:
+                    cache = dict((key, npz[key]) for key in npz.files)
+                valid = str(cache['version']) == demo_cache_version() \
+                    and cache['demos'].tolist() == demos_list and cache['mtimes'].tolist() == mtimes
+            except (BadZipfile, IOError, KeyError, ValueError):
+                print("Could not read demonstration pairs from", cache_file, ", rebuilding")
+                valid = False
+            if valid:
+                print("Loaded demonstration pairs from", cache_file)
+                sa_pairs = []
+                for code, action_type, action_object in zip(
+                    cache['codes'].tolist(), cache['action_types'].tolist(), cache['action_objects'].tolist()
+                ):
+                    a = Action()
+                    a.action_type = action_type
+                    a.object = action_object
+                    sa_pairs.append((state_template.from_code(code), a))
+                return sa_pairs
+
+        sa_pairs = self._read_demo_pairs(amdp_id, demos_list)
+        try:
+            # several nodes build their configurations at startup, so write to
+            # a temporary file and rename it to never expose a partial cache
+            fd, tmp_file = tempfile.mkstemp(prefix='demo_pairs_', suffix='.npz', dir=os.path.dirname(cache_file))
+            os.close(fd)
+            try:
+                np.savez_compressed(
+                    tmp_file,
+                    version=demo_cache_version(),
+                    demos=np.array(demos_list, dtype=str),
+                    mtimes=np.array(mtimes, dtype=float),
+                    codes=np.array([s.code for s, a in sa_pairs], dtype=np.int64),
+                    action_types=np.array([a.action_type for s, a in sa_pairs], dtype=np.int64),
+                    action_objects=np.array([a.object for s, a in sa_pairs], dtype=str)
+                )
+                os.rename(tmp_file, cache_file)
+            except:
+                os.remove(tmp_file)
+                raise
+            print("Saved demonstration pairs to", cache_file)
+        except (IOError, OSError) as e:
+            print("Could not save demonstration pairs to", cache_file, ":", e)
+        return sa_pairs
+
+    def _read_demo_pairs(self, amdp_id, demos_list):
+        """Read the demonstration bags and return their (AMDPState, Action)
+        pairs, with the actions converted to the AMDP action list"""
+        sa_pairs = []
+        prev_state_msg = None
+        for demo_file in demos_list:
+            print("Reading", demo_file, "...")
+            bag = rosbag.Bag(demo_file)
+            for topic, msg, t in bag.read_messages(topics=['/table_sim/task_log']):
+                if prev_state_msg is None:
+                    prev_state_msg = copy.deepcopy(msg.state)
+
+                elif msg.action.action_type != Action.NOOP:
+                    pair = (copy.deepcopy(prev_state_msg), copy.deepcopy(msg.action))
+                    sa_pairs.append(pair)
+                    prev_state_msg = copy.deepcopy(msg.state)
+            bag.close()
+
+        for i, pair in enumerate(sa_pairs):
+            state_msg = pair[0]
+            s = AMDPState(amdp_id=amdp_id, state=OOState(state=state_msg, lazy=True))
+            a = pair[1]
+
+            # convert action into something that fits into the new action list
+            if a.action_type == Action.PLACE:
+                a.object = DataUtils.get_task_frame(state_msg, a.position)
+                a.position = Point()
+            elif a.action_type == Action.MOVE_ARM:
+                a.object = DataUtils.get_task_frame(state_msg, a.position)
+                if a.object != 'stack' and a.object != 'drawer' and a.object != 'box' and a.object != 'lid':
+                    for o in state_msg.objects:
+                        if o.name != 'apple' or o.name != 'banana' or o.name != 'carrot':
+                            continue
+                        if a.position == o.position:
+                            a.object = o.name
+                            break
+
+                    if a.object != 'apple' or a.object != 'banana' or a.object != 'carrot':
+                        x = state_msg.gripper_position.x
+                        y = state_msg.gripper_position.y
+                        px = a.position.x
+                        py = a.position.y
+                        if px == x and py > y:
+                            a.object = 'b'
+                        elif px < x and py > y:
+                            a.object = 'bl'
+                        elif px < x and py == y:
+                            a.object = 'l'
+                        elif px < x and py < y:
+                            a.object = 'fl'
+                        elif px == x and py < y:
+                            a.object = 'f'
+                        elif px > x and py < y:
+                            a.object = 'fr'
+                        elif px > x and py == y:
+                            a.object = 'r'
+                        else:
+                            a.object = 'br'
+                a.position = Point()
+            elif a.action_type == Action.GRASP:
+                a.position = Point()
+            else:
+                a.position = Point()
+                a.object = ''
+
+            sa_pairs[i] = (s, a)
+
+        return sa_pairs
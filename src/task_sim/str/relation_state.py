@@ -47,6 +47,13 @@ class RelationState:
         if state.grippers['gripper'].holding == 'apple':
             self.gripper_holding = 'apple'
 
+    def __deepcopy__(self, memo):
+        # relations only hold booleans, so copying the dictionary is a deep copy
+        s = RelationState()
+        s.relations = dict(self.relations)
+        s.gripper_holding = self.gripper_holding
+        return s
+
     def __hash__(self):
         return hash((frozenset(self.relations.items()), self.gripper_holding))
 
@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+
+from copy import deepcopy
+import datetime
+import hashlib
+import inspect
+import os
+import tempfile
+from zipfile import BadZipfile
+import numpy as np
+from scipy import sparse
+
+from task_sim.msg import Action
+
+from task_sim.str import relation_reward, relation_transitions
+from task_sim.str.relation_state import RelationState
+from task_sim.str.relation_transitions import transition_function
+from task_sim.str.relation_reward import is_terminal
+
+# version of the file layout written by RelationTransitionTable.save
+FORMAT = 2
+
+
+def model_version():
+    '''Hash of the hand-coded relation model (transitions and terminal states) and state layout, stored with a table
+    to detect stale files'''
+    model_hash = hashlib.sha1()
+    model_hash.update(inspect.getsource(relation_transitions))
+    model_hash.update(inspect.getsource(relation_reward))
+    model_hash.update(' '.join(RelationState.relation_list))
+    model_hash.update(str(FORMAT))
+    return model_hash.hexdigest()
+
+
+def encode_states(states):
+    '''Integer codes of a list of RelationStates
+
+    The model also sets relations outside RelationState.relation_list, and a relation that is False differs from one
+    that was never set, so each relation is a base-3 digit of the code (0: not set, 1: False, 2: True), in the order
+    of relation_names, and the most significant digit is the index of the held object in holding_values.
+
+    Returns:
+        (codes as an int64 array, relation_names, holding_values)
+    '''
+    relation_names = list(RelationState.relation_list)
+    extra = set()
+    holding = set()
+    for s in states:
+        extra.update(s.relations)
+        holding.add(s.gripper_holding)
+    relation_names.extend(sorted(extra - set(relation_names)))
+    holding_values = sorted(holding)
+
+    digits = np.array([[s.relations[name] + 1 if name in s.relations else 0 for name in relation_names]
+                       + [holding_values.index(s.gripper_holding)] for s in states], dtype=np.int64)
+    digits = digits.reshape(len(states), len(relation_names) + 1)
+    codes = digits.dot(3**np.arange(len(relation_names) + 1, dtype=np.int64))
+    return codes, relation_names, holding_values
+
+
+def decode_states(codes, relation_names, holding_values):
+    '''RelationStates of codes returned by encode_states'''
+    codes = np.asarray(codes, dtype=np.int64)
+    digits = (codes[:, None]//3**np.arange(len(relation_names) + 1, dtype=np.int64)) % 3
+    states = []
+    for row in digits.tolist():
+        s = RelationState()
+        s.relations = dict((name, value == 2) for name, value in zip(relation_names, row) if value > 0)
+        s.gripper_holding = holding_values[row[-1]]
+        states.append(s)
+    return states
+
+
+class RelationTransitionTable:
+
+    def __init__(self, filename=None):
+        '''Successor distributions of relation_transitions.transition_function, precomputed for the reachable states
+
+        States and actions are indexed by their position in self.states and self.actions. The successors of state i
+        under action k are row i*len(actions) + k of a CSR-style table: successors[row_start[row]:row_start[row + 1]]
+        with the matching probabilities, in the order transition_function returns them. Only the states flagged in
+        expanded have rows; the others were reached at the depth limit of compile() (or are terminal). depth holds the
+        number of actions needed to reach each state.
+
+        Args:
+            filename: .npz file written by save() to load the table from
+        '''
+        self.states = []
+        self.state_ids = {}
+        self.actions = []
+        self.action_ids = {}
+        self.max_depth = None
+        self.expanded = np.zeros(0, dtype=bool)
+        self.depth = np.zeros(0, dtype=np.int64)
+        self.row_start = np.zeros(1, dtype=np.int64)
+        self.successors = np.zeros(0, dtype=np.int64)
+        self.probabilities = np.zeros(0)
+
+        if filename is not None:
+            self.load(filename)
+
+    @classmethod
+    def load_or_compile(cls, filename, initial_states, actions, max_depth=None, debug=0):
+        '''Load a table from filename, or compile it and save it there if the file is missing or out of date'''
+        table = cls()
+        if os.path.exists(filename) and table.load(filename, initial_states, actions, max_depth):
+            if debug > 0:
+                print 'Loaded relation transitions from ' + filename
+            return table
+
+        table.compile(initial_states, actions, max_depth=max_depth, debug=debug)
+        table.save(filename)
+        if debug > 0:
+            print 'Saved relation transitions to ' + filename
+        return table
+
+    def compile(self, initial_states, actions, max_depth=None, debug=0):
+        '''Enumerate the states reachable from initial_states and record the successors of every (state, action)
+
+        Args:
+            initial_states: list of RelationStates to start from
+            actions: list of Actions
+            max_depth: expand only states reached within this many actions (None to expand the full reachable set);
+                successors found beyond it are indexed, but not expanded
+        '''
+        start_time = datetime.datetime.now()
+        self.states = []
+        self.state_ids = {}
+        self.actions = list(actions)
+        self.action_ids = dict((self._action_key(a), k) for k, a in enumerate(self.actions))
+        self.max_depth = max_depth
+
+        expanded = []
+        depths = []
+        row_start = [0]
+        successors = []
+        probabilities = []
+
+        frontier = [self._index(s) for s in initial_states]
+        depth = 0
+        while len(frontier) > 0:
+            if debug > 0:
+                print 'Depth ' + str(depth) + ': ' + str(len(frontier)) + ' states'
+            next_frontier = []
+            for i in frontier:
+                s = self.states[i]
+                # rows are laid out in state order, and states are indexed in the order they are expanded
+                assert i == len(expanded)
+                expand = (max_depth is None or depth <= max_depth) and not is_terminal(s)
+                expanded.append(expand)
+                depths.append(depth)
+                for a in self.actions:
+                    if expand:
+                        for p, s_prime in transition_function(s, a):
+                            j = self.state_ids.get(s_prime)
+                            if j is None:
+                                j = self._index(deepcopy(s_prime))
+                                next_frontier.append(j)
+                            successors.append(j)
+                            probabilities.append(p)
+                    row_start.append(len(successors))
+            frontier = next_frontier
+            depth += 1
+
+        self.expanded = np.array(expanded, dtype=bool)
+        self.depth = np.array(depths, dtype=np.int64)
+        self.row_start = np.array(row_start, dtype=np.int64)
+        self.successors = np.array(successors, dtype=np.int64)
+        self.probabilities = np.array(probabilities, dtype=float)
+
+        if debug > 0:
+            print 'Compiled ' + str(len(self.states)) + ' states (' + str(np.count_nonzero(self.expanded)) + \
+                  ' expanded) in ' + str(datetime.datetime.now() - start_time)
+
+    def save(self, filename):
+        '''Write the table to filename, through a temporary file renamed into place so readers never see a partial
+        file'''
+        codes, relation_names, holding_values = encode_states(self.states)
+        fd, tmp_filename = tempfile.mkstemp(suffix='.npz', dir=os.path.dirname(os.path.abspath(filename)))
+        os.close(fd)
+        try:
+            self._write(tmp_filename, codes, relation_names, holding_values)
+            os.rename(tmp_filename, filename)
+        except:
+            os.remove(tmp_filename)
+            raise
+
+    def _write(self, filename, codes, relation_names, holding_values):
+        np.savez_compressed(
+            filename,
+            version=model_version(),
+            max_depth=-1 if self.max_depth is None else self.max_depth,
+            codes=codes,
+            relation_names=np.array(relation_names, dtype=str),
+            holding_values=np.array(holding_values, dtype=str),
+            action_types=np.array([a.action_type for a in self.actions], dtype=np.int64),
+            action_objects=np.array([a.object for a in self.actions], dtype=str),
+            expanded=self.expanded,
+            depth=self.depth,
+            row_start=self.row_start,
+            successors=self.successors,
+            probabilities=self.probabilities
+        )
+
+    def load(self, filename, initial_states=None, actions=None, max_depth=None):
+        '''Read a table written by save()
+
+        Args:
+            initial_states, actions, max_depth: if initial_states is given, the table must have been compiled from
+                these arguments (the initial states are the first states of a compiled table)
+
+        Returns:
+            False (leaving the table empty) if the file can't be read, or was compiled from a different model or other
+            arguments
+        '''
+        try:
+            with np.load(filename) as npz:
+                data = dict((key, npz[key]) for key in npz.files)
+            version = str(data['version'])
+        except (BadZipfile, IOError, KeyError, ValueError):
+            return False
+        if version != model_version():
+            return False
+        stored_depth = int(data['max_depth'])
+        if stored_depth < 0:
+            stored_depth = None
+
+        states = decode_states(data['codes'], data['relation_names'].tolist(), data['holding_values'].tolist())
+        stored_actions = []
+        for action_type, action_object in zip(data['action_types'].tolist(), data['action_objects'].tolist()):
+            a = Action()
+            a.action_type = action_type
+            a.object = action_object
+            stored_actions.append(a)
+
+        if initial_states is not None:
+            if stored_depth != max_depth or states[:len(initial_states)] != list(initial_states) \
+                    or map(self._action_key, stored_actions) != map(self._action_key, actions):
+                return False
+
+        self.states = states
+        self.state_ids = dict((s, i) for i, s in enumerate(states))
+        self.actions = stored_actions
+        self.action_ids = dict((self._action_key(a), k) for k, a in enumerate(self.actions))
+        self.max_depth = stored_depth
+        self.expanded = data['expanded']
+        self.depth = data['depth']
+        self.row_start = data['row_start']
+        self.successors = data['successors']
+        self.probabilities = data['probabilities']
+        return True
+
+    def row(self, i, k):
+        '''Successors of state i under action k, as a list of (probability, state index)'''
+        row = i*len(self.actions) + k
+        start = self.row_start[row]
+        end = self.row_start[row + 1]
+        return zip(self.probabilities[start:end].tolist(), self.successors[start:end].tolist())
+
+    def transition_matrix(self):
+        '''The table as one sparse (S*A x S) matrix, where row i*len(actions) + k is the successor distribution of
+        (states[i], actions[k]); the rows of unexpanded states are empty'''
+        return sparse.csr_matrix((self.probabilities, self.successors, self.row_start),
+                                 shape=(len(self.states)*len(self.actions), len(self.states)))
+
+    def transition_function(self, s, a):
+        '''Same as relation_transitions.transition_function, read from the table when (s, a) was compiled
+
+        The returned states are shared with the table and must not be modified.
+        '''
+        i = self.state_ids.get(s)
+        k = self.action_ids.get(self._action_key(a))
+        if i is None or k is None or not self.expanded[i]:
+            return transition_function(s, a)
+        return [(p, self.states[j]) for p, j in self.row(i, k)]
+
+    def _index(self, s):
+        self.state_ids[s] = len(self.states)
+        self.states.append(s)
+        return self.state_ids[s]
+
+    def _action_key(self, a):
+        return (a.action_type, a.object)
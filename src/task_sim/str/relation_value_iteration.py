@@ -3,23 +3,42 @@
 from copy import deepcopy
 import datetime
 import pickle
+import numpy as np
 
 from task_sim.msg import Action
 
 from task_sim.str.relation_state import RelationState
-from task_sim.str.relation_transitions import transition_function
+from task_sim.str.relation_transition_table import RelationTransitionTable, decode_states, encode_states
 from task_sim.str.relation_reward import reward, is_terminal
 
 
+def save_utilities(filename, codes, relation_names, holding_values, U):
+    '''Save utilities as an .npz file of state codes (see encode_states) and values'''
+    np.savez_compressed(filename, codes=codes, relation_names=np.array(relation_names, dtype=str),
+                        holding_values=np.array(holding_values, dtype=str), U=U)
+
+
+def load_utilities(filename):
+    '''Utilities saved by save_utilities, as a dict of RelationState -> utility'''
+    data = np.load(filename)
+    states = decode_states(data['codes'], data['relation_names'].tolist(), data['holding_values'].tolist())
+    return dict(zip(states, data['U'].tolist()))
+
+
 class RelationValueIteration:
     grasp_objects = ['drawer', 'apple']
     place_objects = ['stack', 'drawer', '']
     move_objects = ['drawer', 'stack', 'apple', 'l', 'f', 'r', 'b', 'fl', 'fr', 'br', 'bl']
     gripper_objects = ['', 'drawer', 'apple']
+    # the state set stops growing after this many iterations
+    max_depth = 8
 
-    def __init__(self, load=False):
+    def __init__(self, load=False, transitions_file='relation_transitions.npz'):
         self.U = {}
         self.actions = []
+        # compiled transition function, loaded (or compiled and saved) when solving starts
+        self.transitions_file = transitions_file
+        self.T = None
 
         # if load:
         #     self.U = pickle.load(file('U0.pkl'))
@@ -205,13 +224,27 @@ class RelationValueIteration:
         #pickle.dump(self.U, file('U0.pkl', mode='w'))
         #pickle.dump(self.actions, file('A.pkl', mode='w'))
 
-    def solve(self):
+    def solve(self, compiled=False, checkpoint_interval=1):
+        '''Solve for the utilities U, saving them every checkpoint_interval iterations once termination checking
+        starts (0 to only save the result)
+
+        Args:
+            compiled: run the array-based solve_compiled instead, which saves .npz files rather than pickles
+        '''
+        if compiled:
+            self.solve_compiled(checkpoint_interval=checkpoint_interval)
+            return
+
         gamma = 0.8
         epsilon = 10
         n = 0
         termination_check = False
         start_time = datetime.datetime.now()
 
+        # only states within max_depth actions of the start are ever expanded
+        self.T = RelationTransitionTable.load_or_compile(self.transitions_file, self.U.keys(), self.actions,
+                                                         max_depth=self.max_depth, debug=1)
+
         while True:
             n += 1
             print 'Iteration ' + str(n)
@@ -239,15 +272,15 @@ class RelationValueIteration:
 
                 max_u = -999999
                 for a in self.actions:
-                    successors = transition_function(s, a)
+                    successors = self.T.transition_function(s, a)
                     current_u = 0.0
                     for i in range(len(successors)):
                         p = successors[i][0]
                         s_prime = successors[i][1]
 
                         if s_prime not in self.U:
-                            # Fix state size at iteration 8
-                            if n > 8:
+                            # Fix state size at iteration max_depth
+                            if n > self.max_depth:
                                 continue
                             else:
                                 U_prime[deepcopy(s_prime)] = 0.0
@@ -275,7 +308,8 @@ class RelationValueIteration:
                 if delta < epsilon*(1 - gamma)/gamma:
                     break
                 print 'Delta: ' + str(delta) + ', continuing...'
-                pickle.dump(self.U, file('U_iter_' + str(n) + '.pkl', mode='w'))
+                if checkpoint_interval > 0 and n % checkpoint_interval == 0:
+                    pickle.dump(self.U, file('U_iter_' + str(n) + '.pkl', mode='w'))
             print 'Elapsed time: ' + str(datetime.datetime.now() - start_time)
 
         print 'Total elapsed time: ' + str(datetime.datetime.now() - start_time)
@@ -283,7 +317,57 @@ class RelationValueIteration:
         pickle.dump(self.U, file('trained_U.pkl', mode='w'))
         print 'Utilities saved.'
 
+    def solve_compiled(self, checkpoint_interval=1):
+        '''Value iteration over the integer-indexed states of the transition table, with the Bellman backup of every
+        state and action computed as one sparse matrix-vector product. Follows the same schedule as solve() (the state
+        set grows by one action per iteration up to max_depth, and termination is checked once a terminal state is
+        in it), and saves utilities with save_utilities to U_iter_N.npz and trained_U.npz.'''
+        gamma = 0.8
+        epsilon = 10
+        n = 0
+        termination_check = False
+        start_time = datetime.datetime.now()
+
+        self.T = RelationTransitionTable.load_or_compile(self.transitions_file, self.U.keys(), self.actions,
+                                                         max_depth=self.max_depth, debug=1)
+        states = self.T.states
+        P = self.T.transition_matrix()
+        R = np.array([reward(s) for s in states], dtype=float)
+        terminal = np.array([is_terminal(s) for s in states], dtype=bool)
+        codes, relation_names, holding_values = encode_states(states)
+        U = np.array([self.U.get(s, 0.0) for s in states], dtype=float)
+
+        while True:
+            n += 1
+            print 'Iteration ' + str(n)
+            # a state is in U from the iteration after it is first reached, until the state set is fixed
+            active = self.T.depth < min(n, self.max_depth + 1)
+            if termination_check:
+                print '\t(now checking for termination)'
+            print '\tSize of state space: ' + str(np.count_nonzero(active))
+            termination_check = termination_check or np.any(terminal & active)
+
+            max_u = P.dot(U).reshape(len(states), len(self.T.actions)).max(axis=1)
+            U_prime = np.where(active, np.where(terminal, R, R + gamma*max_u), 0.0)
+            delta = float(np.max(np.abs(U - U_prime)[active]))
+            U = U_prime
+
+            if termination_check:
+                if delta < epsilon*(1 - gamma)/gamma:
+                    break
+                print 'Delta: ' + str(delta) + ', continuing...'
+                if checkpoint_interval > 0 and n % checkpoint_interval == 0:
+                    save_utilities('U_iter_' + str(n) + '.npz', codes[active], relation_names, holding_values,
+                                   U[active])
+            print 'Elapsed time: ' + str(datetime.datetime.now() - start_time)
+
+        print 'Total elapsed time: ' + str(datetime.datetime.now() - start_time)
+        print 'Finished. Saving...'
+        self.U = dict((s, u) for s, u, in_U in zip(states, U.tolist(), active.tolist()) if in_U)
+        save_utilities('trained_U.npz', codes[active], relation_names, holding_values, U[active])
+        print 'Utilities saved.'
+
 
 if __name__ == '__main__':
     r = RelationValueIteration(load=True)
-    r.solve()
+    r.solve(compiled=True, checkpoint_interval=5)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+from collections import OrderedDict
+import threading
+
+from task_sim.oomdp.oo_state import OOState
+from task_sim.str.amdp_state import AMDPState
+
+
+def state_key(state):
+    '''Hashable key of the fields of a State message that its OOState is built from (object and container poses, box,
+    drawer and lid positions, gripper)'''
+    return (
+        tuple((o.unique_name, o.name, o.position.x, o.position.y, o.position.z) for o in state.objects),
+        tuple((c.unique_name, c.name, c.position.x, c.position.y, c.position.z, c.width, c.height)
+              for c in state.containers),
+        state.box_position.x, state.box_position.y,
+        state.drawer_position.x, state.drawer_position.y, state.drawer_opening,
+        state.lid_position.x, state.lid_position.y, state.lid_position.z,
+        state.gripper_position.x, state.gripper_position.y, state.gripper_position.z,
+        state.gripper_open, state.object_in_gripper
+    )
+
+
+class StateProjections:
+
+    def __init__(self, oo_state):
+        '''The OOState of a State message and the AMDPStates projected from it so far'''
+        self.oo_state = oo_state
+        self._amdp_states = {}
+
+    def amdp_state(self, amdp_id, ground_items=None):
+        '''AMDPState(amdp_id, oo_state, ground_items), shared between calls and not to be modified'''
+        key = (amdp_id, None if ground_items is None else tuple(ground_items))
+        s = self._amdp_states.get(key)
+        if s is None:
+            s = AMDPState(amdp_id=amdp_id, state=self.oo_state, ground_items=ground_items)
+            self._amdp_states[key] = s
+        return s
+
+
+class StateProjectionCache:
+
+    def __init__(self, size=8, continuous=False):
+        '''Least-recently-used cache of the projections of State messages, so the relations of a state are computed
+        once however many times it is queried (e.g. by select_action and then query_status)
+
+        Args:
+            size: number of State messages to keep
+            continuous: whether the states come from the real robot, see OOState
+        '''
+        self.size = size
+        self.continuous = continuous
+        self._entries = OrderedDict()  # state_key -> StateProjections, least recently used first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, state, prev=None):
+        '''Returns the StateProjections of a State message, building its (lazily evaluated) OOState on a miss
+
+        Args:
+            state: State message
+            prev: OOState of an earlier State message to reuse relations from on a miss
+        '''
+        key = state_key(state)
+        with self._lock:
+            projections = self._entries.pop(key, None)
+            if projections is None:
+                self.misses += 1
+                projections = StateProjections(OOState(state=state, continuous=self.continuous, prev=prev, lazy=True))
+            else:
+                self.hits += 1
+            self._entries[key] = projections
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return projections
@@ -0,0 +1,131 @@
+"""A batch of independent table simulators that are reset and stepped together.
+
+The simulators are TableSimCore instances held either in this process or sharded across a pool of worker processes,
+so many episodes (e.g. evaluation over a list of seeds) can advance without a ROS service call per action.
+"""
+
+# Python
+import multiprocessing
+
+from task_sim.msg import Status
+from task_sim.table_sim_core import TableSimCore
+
+def _run_worker(conn, num_envs, sim_kwargs):
+    """Serve reset/step commands for a shard of simulators until told to close
+
+    Keyword arguments:
+    conn -- worker end of the pipe to the VectorTableSim
+    num_envs -- number of simulators held by this worker
+    sim_kwargs -- keyword arguments for each TableSimCore
+    """
+    sims = [TableSimCore(**sim_kwargs) for i in range(num_envs)]
+    while True:
+        command, data = conn.recv()
+        if command == 'reset':
+            conn.send([sim.reset(seed) for sim, seed in zip(sims, data)])
+        elif command == 'step':
+            conn.send([sim.step(action) if action is not None else None for sim, action in zip(sims, data)])
+        else:
+            break
+    conn.close()
+
+
+class VectorTableSim(object):
+
+    def __init__(self, num_envs, processes=0, status_function=None, **sim_kwargs):
+        """Create a batch of simulators
+
+        Keyword arguments:
+        num_envs -- number of independent simulators
+        processes -- number of worker processes to shard the simulators across, 0 to keep them in this process
+        status_function -- function mapping a State message to a Status code; None reports every state IN_PROGRESS
+        sim_kwargs -- keyword arguments passed to every TableSimCore (complexity, env_type, ...)
+        """
+        self.num_envs = num_envs
+        self.status_function = status_function
+        self.states = [None]*num_envs
+
+        self.sims = []
+        self.workers = []
+        if processes > 0:
+            processes = min(processes, num_envs)
+            for i in range(processes):
+                # contiguous shards, so results concatenate back into environment order
+                shard = num_envs//processes + (1 if i < num_envs % processes else 0)
+                parent_conn, child_conn = multiprocessing.Pipe()
+                worker = multiprocessing.Process(target=_run_worker, args=(child_conn, shard, sim_kwargs))
+                worker.daemon = True
+                worker.start()
+                child_conn.close()
+                self.workers.append((parent_conn, worker, shard))
+        else:
+            self.sims = [TableSimCore(**sim_kwargs) for i in range(num_envs)]
+
+
+    def reset_all(self, seeds=None):
+        """Regenerate every world and return the list of initial states
+
+        Keyword arguments:
+        seeds -- list of num_envs random seeds (entries may be None for a random world), or None for all random
+        """
+        if seeds is None:
+            seeds = [None]*self.num_envs
+        if len(seeds) != self.num_envs:
+            raise ValueError('Expected ' + str(self.num_envs) + ' seeds, got ' + str(len(seeds)))
+
+        if self.workers:
+            self.states = self._dispatch('reset', seeds)
+        else:
+            self.states = [sim.reset(seed) for sim, seed in zip(self.sims, seeds)]
+        return list(self.states)
+
+
+    def step_batch(self, actions):
+        """Execute one action in each simulator
+
+        Keyword arguments:
+        actions -- list of num_envs actions (msg/Action); a None entry leaves that simulator untouched
+
+        Returns:
+        states -- list of the resulting states (the current state for untouched simulators)
+        statuses -- list of Status codes for the stepped simulators, None for untouched ones
+        """
+        if len(actions) != self.num_envs:
+            raise ValueError('Expected ' + str(self.num_envs) + ' actions, got ' + str(len(actions)))
+
+        if self.workers:
+            results = self._dispatch('step', actions)
+        else:
+            results = [sim.step(action) if action is not None else None for sim, action in zip(self.sims, actions)]
+
+        statuses = [None]*self.num_envs
+        for i in range(self.num_envs):
+            if results[i] is None:
+                continue
+            self.states[i] = results[i]
+            if self.status_function is None:
+                statuses[i] = Status.IN_PROGRESS
+            else:
+                statuses[i] = self.status_function(results[i])
+        return list(self.states), statuses
+
+
+    def close(self):
+        """Shut down any worker processes"""
+        for conn, worker, shard in self.workers:
+            conn.send(('close', None))
+            conn.close()
+            worker.join()
+        self.workers = []
+
+
+    def _dispatch(self, command, data):
+        """Send each worker its shard of data, then gather the replies in environment order"""
+        start = 0
+        for conn, worker, shard in self.workers:
+            conn.send((command, data[start:start + shard]))
+            start += shard
+        results = []
+        for conn, worker, shard in self.workers:
+            results.extend(conn.recv())
+        return results
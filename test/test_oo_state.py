@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+import random
+import unittest
+
+from geometry_msgs.msg import Point
+
+from task_sim.msg import Action
+from task_sim.oomdp.oo_state import OOState, relation_checks, _pair_relations
+from task_sim.oomdp.oomdp_batch import BatchRelations
+from task_sim.oomdp.oomdp_classes import Box, Container, Drawer, Gripper, Item, Lid, Stack
+from task_sim.table_sim_core import TableSimCore
+
+
+def related_pairs(groups):
+    """(obj1, obj2, checks) for every pair of objects that relation_checks relates, from a dict of group -> objects"""
+    for group1, group2, checks in relation_checks:
+        objects1 = groups.get(group1, [])
+        for i in range(len(objects1)):
+            objects2 = objects1[i + 1:] if group1 == group2 else groups.get(group2, [])
+            for obj2 in objects2:
+                yield objects1[i], obj2, checks
+
+
+def reference_relations(oo_state):
+    """Relations of an OOState and of each of its objects, evaluated pair by pair with the oomdp_classes methods"""
+    groups = dict((group, getattr(oo_state, group).values()) for group in OOState.groups)
+    relations = set()
+    object_relations = dict((id(obj), set()) for objects in groups.values() for obj in objects)
+    for obj1, obj2, checks in related_pairs(groups):
+        relations1, relations2 = _pair_relations(obj1, obj2, checks)
+        object_relations[id(obj1)].update(relations1)
+        object_relations[id(obj2)].update(relations2)
+        relations.update(relations1)
+        relations.update(relations2)
+    return relations, object_relations
+
+
+def random_world(rng, continuous):
+    """Random objects of every class, as a dict of group -> objects"""
+    if continuous:
+        f = lambda a, b: round(rng.uniform(a, b), 2)
+        return {
+            'items': [Item(f(-.5, .5), f(-.5, .5), f(0, .5), continuous=True) for i in range(4)],
+            'grippers': [Gripper(f(-.5, .5), f(-.5, .5), f(0, .5), continuous=True)],
+            'boxes': [Box(f(-.5, .5), f(-.5, .5), radius=.1, continuous=True)],
+            'lids': [Lid(f(-.5, .5), f(-.5, .5), f(0, .3), radius=.1, continuous=True)],
+            'drawers': [Drawer(f(-.5, .5), f(-.5, .5), width=.3, depth=.2, continuous=True)],
+            'stacks': [Stack(f(-.5, .5), f(-.5, .5), width=.3, depth=.2, continuous=True)],
+            'containers': [Container(rng.randint(-5, 5), rng.randint(-5, 5), rng.randint(0, 3))]
+        }
+    g = lambda: rng.randint(-6, 6)
+    return {
+        'items': [Item(g(), g(), rng.randint(0, 4)) for i in range(4)],
+        'grippers': [Gripper(g(), g(), rng.randint(0, 4))],
+        'boxes': [Box(g(), g(), radius=rng.randint(1, 2))],
+        'lids': [Lid(g(), g(), rng.randint(0, 3), radius=rng.randint(1, 2))],
+        'drawers': [Drawer(g(), g(), width=rng.choice([5, 7]), depth=rng.choice([3, 5]))],
+        'stacks': [Stack(g(), g(), width=rng.choice([5, 7]), depth=rng.choice([3, 5]))],
+        'containers': [Container(g(), g(), rng.randint(0, 3), width=rng.randint(1, 3), depth=rng.randint(1, 3))
+                       for i in range(2)]
+    }
+
+
+def random_trajectory(seed, complexity, env_type, length=40):
+    """States of a simulator driven by random actions"""
+    rng = random.Random(seed)
+    sim = TableSimCore(complexity=complexity, env_type=env_type, seed=seed)
+    states = [sim.reset(seed)]
+    sim.rng.seed(seed)
+    names = [o.unique_name for o in states[0].objects] + [c.unique_name for c in states[0].containers] + \
+            ['drawer', 'lid']
+    for i in range(length):
+        action = Action()
+        action.action_type = rng.choice([Action.GRASP, Action.PLACE, Action.OPEN_GRIPPER, Action.CLOSE_GRIPPER,
+                                         Action.MOVE_ARM, Action.RAISE_ARM, Action.LOWER_ARM, Action.RESET_ARM])
+        action.object = rng.choice(names)
+        action.position = Point(rng.randint(0, 40), rng.randint(0, 15), 0)
+        states.append(sim.step(action))
+    return states
+
+
+class TestBatchRelations(unittest.TestCase):
+
+    def test_matches_pair_methods(self):
+        rng = random.Random(0)
+        checked = 0
+        for n in range(400):
+            groups = random_world(rng, continuous=n % 2 == 1)
+            batch = BatchRelations([obj for objects in groups.values() for obj in objects])
+            for obj1, obj2, checks in related_pairs(groups):
+                for predicate, relation, sort in checks:
+                    if not batch.covers(predicate, obj1):
+                        continue
+                    checked += 1
+                    self.assertEqual(batch.value(predicate, obj1, obj2), bool(getattr(obj1, predicate)(obj2)),
+                                     '{} {} {}: {} vs {}'.format(obj1.__class__.__name__, predicate,
+                                                                 obj2.__class__.__name__, vars(obj1), vars(obj2)))
+        self.assertGreater(checked, 0)
+
+
+class TestOOStateRelations(unittest.TestCase):
+
+    configurations = [(0, 0), (0, 1), (0, 3), (1, 0), (2, 0)]
+
+    # relations that can't hold, or don't hold in most states
+    absent = ['apple_inside_drawer', 'gripper_above_lid', 'lid_closing_box', 'drawer_touching_box', 'apple_atop_apple']
+
+    def assertRelations(self, oo_state, expected, msg=None):
+        relations, object_relations = expected
+        self.assertEqual(set(oo_state.relations), relations, msg)
+        for group in OOState.groups:
+            for obj in getattr(oo_state, group).values():
+                self.assertEqual(obj.relations, object_relations[id(obj)], msg)
+
+    def test_full(self):
+        for complexity, env_type in self.configurations:
+            for state in random_trajectory(0, complexity, env_type, length=10):
+                oo_state = OOState(state)
+                self.assertRelations(oo_state, reference_relations(oo_state))
+
+    def test_lazy(self):
+        for complexity, env_type in self.configurations:
+            for state in random_trajectory(0, complexity, env_type, length=10):
+                oo_state = OOState(state, lazy=True)
+                # membership queries only evaluate the pairs they name, and must agree with a full evaluation
+                relations = reference_relations(OOState(state))[0]
+                for relation in sorted(relations) + self.absent:
+                    self.assertEqual(relation in oo_state.relations, relation in relations, relation)
+                self.assertRelations(oo_state, reference_relations(oo_state))
+
+    def test_incremental(self):
+        rng = random.Random(0)
+        for complexity, env_type in self.configurations:
+            for seed in range(2):
+                prev = None
+                prev_lazy = None
+                for step, state in enumerate(random_trajectory(seed, complexity, env_type)):
+                    oo_state = OOState(state, prev=prev)
+                    self.assertRelations(oo_state, reference_relations(oo_state))
+                    prev = oo_state
+
+                    # lazy states reuse the pairs evaluated so far, so most are only queried in part before the next
+                    relations = reference_relations(OOState(state))[0]
+                    oo_state = OOState(state, prev=prev_lazy, lazy=True)
+                    for relation in rng.sample(sorted(relations), min(5, len(relations))) + self.absent:
+                        self.assertEqual(relation in oo_state.relations, relation in relations, relation)
+                    if step % 4 == 3:
+                        self.assertRelations(oo_state, reference_relations(oo_state))
+                    prev_lazy = oo_state
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+import random
+import unittest
+from math import floor
+
+import numpy as np
+
+from task_sim.rl.tile_coder import IHT, tiles, tiles_batch
+
+
+class ReferenceIHT:
+    """The dictionary-based IHT of the original tile coding software: indices are given out in order of first use, and
+    once the table is full, unseen coordinates hash to an index"""
+
+    def __init__(self, size):
+        self.size = size
+        self.dictionary = {}
+
+    def getindex(self, obj, readonly=False):
+        if obj in self.dictionary:
+            return self.dictionary[obj]
+        if readonly:
+            return None
+        if len(self.dictionary) >= self.size:
+            return hash(obj) % self.size
+        self.dictionary[obj] = len(self.dictionary)
+        return self.dictionary[obj]
+
+
+def reference_tiles(iht, numtilings, floats, ints, readonly=False):
+    qfloats = [floor(f*numtilings) for f in floats]
+    indices = []
+    for tiling in range(numtilings):
+        coords = [tiling]
+        b = tiling
+        for q in qfloats:
+            coords.append((q + b)//numtilings)
+            b += tiling*2
+        coords.extend(ints)
+        indices.append(iht.getindex(tuple(coords), readonly))
+    return indices
+
+
+class TestTileCoder(unittest.TestCase):
+
+    def sample(self, rng):
+        floats = [rng.uniform(-3, 3) if rng.random() < 0.7 else rng.randint(-3, 3) for i in range(4)]
+        return floats, [rng.randint(0, 5), rng.choice([-5, 0, 1, 2])]
+
+    def test_batch_matches_scalar(self):
+        # the smaller tables fill up early, so most tiles go through the collision path
+        for size, numtilings in [(1024**2, 32), (2000, 16), (100, 8)]:
+            rng = random.Random(size)
+            reference = ReferenceIHT(size)
+            scalar = IHT(size)
+            batch = IHT(size)
+            for n in range(100):
+                rows = [self.sample(rng) for i in range(rng.randint(1, 6))]
+                # repeat rows within a batch, which must get the index of their first occurrence
+                rows.append(rng.choice(rows))
+                readonly = rng.random() < 0.1
+
+                expected = [reference_tiles(reference, numtilings, floats, ints, readonly) for floats, ints in rows]
+                self.assertEqual([tiles(scalar, numtilings, floats, ints, readonly) for floats, ints in rows],
+                                 expected)
+                indices = tiles_batch(batch, numtilings, [floats for floats, ints in rows],
+                                      [ints for floats, ints in rows], readonly)
+                self.assertEqual([[None if index < 0 else index for index in row] for row in indices.tolist()],
+                                 expected)
+            self.assertEqual(batch.count(), min(len(reference.dictionary), size))
+            self.assertEqual(scalar.count(), batch.count())
+            self.assertEqual(scalar.overfullCount, batch.overfullCount)
+            if size < 1000:
+                self.assertGreater(batch.overfullCount, 0)
+
+    def test_batch_without_iht(self):
+        rng = random.Random(0)
+        rows = [self.sample(rng) for i in range(5)]
+        floats = [f for f, i in rows]
+        ints = [i for f, i in rows]
+        self.assertEqual(tiles_batch(1000, 8, floats, ints).tolist(), [tiles(1000, 8, f, i) for f, i in rows])
+        self.assertTrue(np.array_equal(tiles_batch(None, 8, floats, ints),
+                                       [tiles(None, 8, f, i) for f, i in rows]))
+
+
+if __name__ == '__main__':
+    unittest.main()
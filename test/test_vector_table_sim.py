@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import random
+import unittest
+
+from geometry_msgs.msg import Point
+
+from task_sim.msg import Action
+from task_sim.table_sim_core import TableSimCore
+from task_sim.vector_table_sim import VectorTableSim
+
+
+def random_actions(seed, n):
+    rng = random.Random(seed)
+    objects = ['apple', 'banana', 'carrot', 'daikon', 'lid', 'drawer', 'small0', 'large0', 'batteries0']
+    actions = []
+    for i in range(n):
+        action = Action()
+        action.action_type = rng.choice([Action.GRASP, Action.PLACE, Action.OPEN_GRIPPER, Action.CLOSE_GRIPPER,
+                                         Action.MOVE_ARM, Action.RAISE_ARM, Action.LOWER_ARM, Action.RESET_ARM])
+        action.object = rng.choice(objects)
+        action.position = Point(rng.randint(0, 40), rng.randint(0, 15), 0)
+        actions.append(action)
+    return actions
+
+
+class TestVectorTableSim(unittest.TestCase):
+
+    def episode(self, seed, actions):
+        """States of an episode on a simulator of its own"""
+        sim = TableSimCore(complexity=2, seed=seed)
+        states = [sim.reset(seed)]
+        sim.rng.seed(seed)
+        for action in actions:
+            states.append(sim.step(action))
+        return states
+
+    def test_episodes_are_independent(self):
+        seeds = [3, 4, 5, 6]
+        actions = [random_actions(seed, 30) for seed in seeds]
+
+        sims = VectorTableSim(len(seeds), complexity=2)
+        states = [[state] for state in sims.reset_all(seeds)]
+        for sim, seed in zip(sims.sims, seeds):
+            sim.rng.seed(seed)
+        for step in range(30):
+            # neither the global random stream nor the other episodes of the batch may change an episode
+            random.seed(step)
+            random.random()
+            batch = [actions[i][step] if (i + step) % 3 else None for i in range(len(seeds))]
+            stepped = sims.step_batch(batch)[0]
+            for i in range(len(seeds)):
+                if batch[i] is not None:
+                    states[i].append(stepped[i])
+        sims.close()
+
+        for i in range(len(seeds)):
+            taken = [action for step, action in enumerate(actions[i]) if (i + step) % 3]
+            self.assertEqual(states[i], self.episode(seeds[i], taken))
+
+
+if __name__ == '__main__':
+    unittest.main()